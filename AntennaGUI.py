@@ -1,19 +1,26 @@
 import customtkinter as ctk
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import time
+from matplotlib.collections import LineCollection
+from matplotlib.transforms import blended_transform_factory
 import numpy as np
+from BlitChart import BlitChart
+from Clustering import window_stats
+from Metrics import metrics
 
 # Waterfall Plot of signal strengths vs MACIDs
 
 
 class AntennaGUI:
     def __init__(self, root, x, **callbacks):
-        print(x)
         self.root = root
         self.UPDATE = True
         self.COLOURS = ["#e50494", "#f77aff", "#7789e1", "#007bc9", "#9dead0",
                         "#7de1ac", "#03b751", "#e9f947", "#cdc90f", "#c5a709"]
+        self.AV_BARS = 25
+        self.UPDATE_BARS = 8
+        # Smoothed series the average bars rank by, when the store has one
+        self.AV_LEVEL = 'kalman'
         self.create_antenna_hud(x, **callbacks)
         self.update_counter = 1
 
@@ -80,7 +87,7 @@ class AntennaGUI:
         # Total Signal count textbox
         self.total_device_count = ctk.CTkLabel(
             master=self.root,
-            text=f"Total Device Count\n{len(x.MACID.unique())}",
+            text=f"Total Device Count\n{self.device_count(x)}",
             width=200,
             height=100,
             font=("Roboto",18)
@@ -90,7 +97,7 @@ class AntennaGUI:
         # Active Signal count textbox
         self.total_signal_count = ctk.CTkLabel(
             master=self.root,
-            text=f"Total Signal Count\n{x.shape[0]}",
+            text=f"Total Signal Count\n{x.stats[None].total()[0]}",
             width=200,
             height=100,
             font=("Roboto",18)
@@ -100,7 +107,7 @@ class AntennaGUI:
         # Average Signal Strength
         self.av_rssi = ctk.CTkLabel(
             master=self.root,
-            text=f"Av. RSSI\n{round(x.RSSI.mean(), 1)}",
+            text=f"Av. RSSI\n{round(x.stats[None].total()[1], 1)}",
             width=200,
             height=100,
             font=("Roboto",18))
@@ -109,127 +116,190 @@ class AntennaGUI:
         # Average Signals per second
         self.av_signals = ctk.CTkLabel(
             master=self.root,
-            text=f"Av. Signals per Second\n{round(x[(x.Time - time.time()) < 5].shape[0], 1)}",
+            text=f"Av. Signals per Second\n{round(x.stats[5].total()[0], 1)}",
             width=200,
             height=100,
             font=("Roboto",18))
         self.av_signals.place(relx=0.19, rely=0.26)
 
     def update(self, x):
-        self.total_device_count.configure(text=f"Total Device Count\n{len(x.MACID.unique())}")
-        self.total_signal_count.configure(text=f"Total Signal Count\n{x.shape[0]}")
+        self.total_device_count.configure(text=f"Total Device Count\n{self.device_count(x)}")
+        self.total_signal_count.configure(text=f"Total Signal Count\n{x.stats[None].total()[0]}")
 
         cutoff = 5
 
-        av_rssi = round(x.RSSI[(time.time() - x.Time) < cutoff].mean(), 1)
-        av_sig = round(x[(time.time() - x.Time) < cutoff].shape[0] / cutoff, 1)
+        count, av_rssi = x.stats[cutoff].total()
+        av_rssi = round(av_rssi, 1)
+        av_sig = round(count / cutoff, 1)
         self.av_rssi.configure(text=f"Average RSSI\n{av_rssi}")
         self.av_signals.configure(text=f"Average Signals per Second\n{av_sig}")
 
-        self.create_update_bar(x, new=False)
+        with metrics.timer('draw.antenna.update_bar'):
+            self.create_update_bar(x, new=False)
 
+        # The heavier charts take turns so they never share a frame
         if self.update_counter % 5 == 0:
-            self.create_hist(x, new=False)
-            self.create_av_bar(x, new=False)
+            with metrics.timer('draw.antenna.hist'):
+                self.create_hist(x, new=False)
+        elif self.update_counter % 5 == 2:
+            with metrics.timer('draw.antenna.av_bar'):
+                self.create_av_bar(x, new=False)
 
         self.update_counter += 1
 
+    def device_count(self, x):
+        # Logical devices, a phone that has rotated its MAC counting once
+        if x.clusters is None:
+            return len(x.devices)
+
+        return x.clusters.count()
+
     def create_av_bar(self, x, new=True):
         '''
-        Creates or updates a bar graph of average RSSI values
+        Creates or updates a bar graph of the devices heard in the last
+        10 seconds, ranked by smoothed RSSI if the store has it or by
+        average RSSI if not
         '''
-        if not new:
-            self.ax.clear()
-
-        now = time.time()
         cutoff=10
-        mask = (now - x.Time) <= cutoff
 
-        avs = x[mask].groupby('MACID').mean().sort_values(by="RSSI", ascending=True)
-        avs.index = [i[0:5] for i in avs.index]
-        avs = avs.iloc[avs.shape[0]-25:, ]
+        # The smoothed level moves far less between frames than the window
+        # mean, so the ranking does not jump about
+        smoothed = self.AV_LEVEL in x.levels
+        counts, means = window_stats(x, cutoff)
+        levels = x.levels
+        if x.clusters is not None:
+            # A logical device is as strong as its latest MAC
+            levels = {name: x.clusters.latest(level) for name, level in levels.items()}
+        if smoothed:
+            means = levels[self.AV_LEVEL]
+        seen = np.flatnonzero(counts)
+        order = seen[np.argsort(means[seen], kind='stable')][-self.AV_BARS:]
+
+        labels = [x.devices.labels[i] for i in order]
+        if 'distance' in levels:
+            labels = [f"{label} ({d:.1f} m)" for label, d in zip(labels, levels['distance'][order])]
+        avs = means[order]
+        y = np.arange(len(order))
 
         if new:
             self.fig, self.ax = plt.subplots()
             self.fig.set_size_inches(5.75, 4.5)
+            self.fig.subplots_adjust(left=0.15)
             self.canvas = FigureCanvasTkAgg(self.fig, master=self.root)
 
-        self.ax.hlines(y=avs.index, xmin=-100, xmax=avs['RSSI'], color='skyblue')
-        self.ax.plot(np.array(avs['RSSI']), np.array(avs.index), "o")
-
-        self.ax.set_title(f'Average RSSI (t={cutoff})')
-        self.ax.set_xlabel("Av. RSSI")
-
-        self.canvas.draw()
+            self.ax.set_xlim(-100, -20)
+            self.ax.set_ylim(-0.5, self.AV_BARS - 0.5)
+            self.ax.set_yticks([])
+            if smoothed:
+                self.ax.set_title(f'Smoothed RSSI ({self.AV_LEVEL})')
+                self.ax.set_xlabel("RSSI")
+            else:
+                self.ax.set_title(f'Average RSSI (t={cutoff})')
+                self.ax.set_xlabel("Av. RSSI")
+
+            # One line, marker and label slot per bar, filled in on update
+            self.av_lines = self.ax.add_collection(LineCollection([], color='skyblue'))
+            self.av_points, = self.ax.plot([], [], "o")
+            label_transform = blended_transform_factory(self.ax.transAxes, self.ax.transData)
+            self.av_labels = [
+                self.ax.text(-0.01, i, '', transform=label_transform,
+                             ha='right', va='center', fontsize=9)
+                for i in range(self.AV_BARS)
+            ]
+            self.av_chart = BlitChart(self.fig, self.canvas,
+                                      [self.av_lines, self.av_points] + self.av_labels)
+
+        self.av_lines.set_segments([[(-100, i), (av, i)] for i, av in zip(y, avs)])
+        self.av_points.set_data(avs, y)
+        for i, text in enumerate(self.av_labels):
+            text.set_text(labels[i] if i < len(labels) else '')
 
         if new:
+            self.canvas.draw()
             self.canvas.get_tk_widget().place(relx=0.02, rely=0.48)
+        else:
+            self.av_chart.update()
 
     def create_update_bar(self, x, new=True):
         '''
         Creates or updates a bar graph of average signals received per second over the last 5 seconds
         '''
-        plt.close()
-        now = time.time()
         cutoff=10
-        mask = (now - x.Time) <= cutoff
-        counts = x[mask]
-        counts = counts.groupby('MACID').count()
 
-        counts.RSSI = counts.RSSI/cutoff
+        counts, _ = window_stats(x, cutoff)
+        order = np.argsort(-counts, kind='stable')[0:self.UPDATE_BARS]
+        order = order[counts[order] > 0]
 
-        counts = counts.sort_values(by="RSSI", ascending=False)
-        counts = counts.iloc[0:8, :]
-        counts.index = [i[0:5] for i in counts.index]
+        labels = [x.devices.labels[i] for i in order]
+        rates = np.zeros(self.UPDATE_BARS)
+        rates[:len(order)] = counts[order]/cutoff
 
         if new:
             self.figup, self.axup = plt.subplots()
-            plt.subplots_adjust(bottom=0.15)
+            self.figup.subplots_adjust(bottom=0.15)
             self.figup.set_size_inches(5.75, 4.5)
             self.canvasup = FigureCanvasTkAgg(self.figup, master=self.root)
 
-        self.axup.bar(counts.index, height=counts.RSSI, label=counts.index, color=self.COLOURS)
-        self.axup.set_title(f'Av. Signals per Second (t={cutoff})')
-        self.axup.set_xticklabels(counts.index, rotation=90, fontsize=10)
-
-        self.canvasup.draw()
+            self.axup.set_title(f'Av. Signals per Second (t={cutoff})')
+            self.axup.set_xticks([])
+            self.axup.set_ylim(0, 1)
+
+            # Fixed bars and label slots, filled in on update
+            self.up_bars = list(self.axup.bar(
+                range(self.UPDATE_BARS), np.zeros(self.UPDATE_BARS),
+                color=self.COLOURS[:self.UPDATE_BARS]
+            ))
+            label_transform = blended_transform_factory(self.axup.transData, self.axup.transAxes)
+            self.up_labels = [
+                self.axup.text(i, -0.01, '', transform=label_transform, rotation=90,
+                               ha='center', va='top', fontsize=10)
+                for i in range(self.UPDATE_BARS)
+            ]
+            self.up_chart = BlitChart(self.figup, self.canvasup, self.up_bars + self.up_labels)
+
+        for bar, rate in zip(self.up_bars, rates):
+            bar.set_height(rate)
+        for i, text in enumerate(self.up_labels):
+            text.set_text(labels[i] if i < len(labels) else '')
+
+        # Rescaling changes the axis, so only then is a full draw needed
+        top = self.axup.get_ylim()[1]
+        if rates[0] > top or (top > 1 and rates[0] < top / 4):
+            self.axup.set_ylim(0, max(1, rates[0] * 1.25))
+            new = True
 
         if new:
+            self.canvasup.draw()
             self.canvasup.get_tk_widget().place(relx=0.5, rely=0.48)
         else:
-            self.axup.clear()
+            self.up_chart.update()
 
     def create_hist(self, x, new=True):
-        now = time.time()
         cutoff = 10
-        mask = (now - x.Time) <= cutoff
 
-        counts = x[mask]
-        counts = counts.groupby('MACID').count().sort_values(by='MACID')
-        counts.RSSI = counts.RSSI/cutoff
-
-        avs = x[mask].groupby('MACID').mean().sort_values(by='MACID')
+        counts, means = window_stats(x, cutoff)
+        seen = np.flatnonzero(counts)
+        rates = counts[seen]/cutoff
+        avs = means[seen]
 
         if new:
             self.figh, self.axh = plt.subplots()
             self.figh.set_size_inches(6.95, 4)
             self.canvash = FigureCanvasTkAgg(self.figh, master=self.root)
 
-            self.graph = self.axh.scatter(avs.RSSI, counts.RSSI, 140, color="#7789e1", alpha=0.4)
+            self.graph = self.axh.scatter(avs, rates, 140, color="#7789e1", alpha=0.4)
             self.axh.set_xlim(-80, -30)
             self.axh.set_ylim(0, 16)
             self.axh.set_title(f"Av. RSSI vs Av. Signals Received (t={cutoff})")
             self.axh.set_xlabel("Av. RSSI")
             self.axh.set_ylabel("Av. Signals Received")
+            self.hist_chart = BlitChart(self.figh, self.canvash, [self.graph])
             self.canvash.draw()
             self.canvash.get_tk_widget().place(relx=0.4, rely=0.025)
 
         else:
-            self.graph.set_offsets(
-                np.array([i for i in zip(avs.RSSI, counts.RSSI)])
-            )
-
-            self.figh.canvas.draw_idle()
+            self.graph.set_offsets(np.column_stack((avs, rates)))
+            self.hist_chart.update()
 
 
     def destroy(self):
@@ -0,0 +1,227 @@
+import os
+import sys
+import time
+import argparse
+import zlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from datetime import datetime, timezone
+from CaptureLog import open_capture, decode_rssi
+
+# Partitioned Parquet archive of captures
+#
+# <root>/date=YYYY-MM-DD/bucket=NN/part-<session>-<chunk>.parquet, with the
+# date in UTC and the bucket a hash of the MAC. Each file is sorted by time
+# and MACs are dictionary encoded, so a query for some MACs over a time range
+# only opens the dates and buckets those could be in, and inside each file
+# skips the row groups whose time statistics are outside the range.
+
+BUCKETS = 16
+ROW_GROUP = 65536
+COMPRESSION = 'zstd'
+
+# Captures are archived this many records at a time
+CHUNK = 4_000_000
+
+SCHEMA = pa.schema([
+    ('MACID', pa.dictionary(pa.int32(), pa.string())),
+    ('RSSI', pa.float32()),
+    ('Time', pa.float64()),
+    ('Adapter', pa.uint8()),
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('date', pa.string()), ('bucket', pa.int32())]), flavor='hive')
+
+
+def bucket(mac):
+    return zlib.crc32(mac.encode()) % BUCKETS
+
+
+def day(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d')
+
+
+def write(root, devices, macs, rssis, times, adapters, session):
+    '''
+    Archives time ordered samples under root, where devices index into
+    macs. Files are named after session, so archiving the same session
+    again replaces its files rather than adding to them.
+
+    Returns the number of files written.
+    '''
+    macs = np.asarray(macs, dtype=object)
+    buckets = np.array([bucket(mac) for mac in macs], dtype=np.int32)
+    written = 0
+
+    for chunk, lo in enumerate(range(0, len(times), CHUNK)):
+        hi = min(lo + CHUNK, len(times))
+        chunk_times = np.asarray(times[lo:hi])
+
+        # Samples are in time order, so each day is one run
+        days = np.floor(chunk_times / 86400)
+        edges = np.flatnonzero(np.diff(days)) + 1
+
+        for start, end in zip(np.r_[0, edges], np.r_[edges, len(days)]):
+            s = slice(lo + start, lo + end)
+            date = day(chunk_times[start])
+            device = np.asarray(devices[s])
+            sample_buckets = buckets[device]
+
+            # A stable sort keeps each bucket in time order
+            order = np.argsort(sample_buckets, kind='stable')
+            bucket_edges = np.searchsorted(sample_buckets[order], np.arange(BUCKETS + 1))
+
+            for b in range(BUCKETS):
+                rows = order[bucket_edges[b]:bucket_edges[b + 1]]
+                if not len(rows):
+                    continue
+
+                path = os.path.join(root, f"date={date}", f"bucket={b:02d}")
+                os.makedirs(path, exist_ok=True)
+
+                _write_file(os.path.join(path, f"part-{session}-{chunk:04d}.parquet"),
+                            device[rows], macs, np.asarray(rssis[s])[rows],
+                            np.asarray(times[s])[rows], np.asarray(adapters[s])[rows])
+                written += 1
+
+    return written
+
+
+def _write_file(filename, device, macs, rssi, ts, adapter):
+    # Only the MACs used in this file go in its dictionary
+    used, indices = np.unique(device, return_inverse=True)
+
+    table = pa.table([
+        pa.DictionaryArray.from_arrays(indices.astype(np.int32), pa.array(macs[used], pa.string())),
+        pa.array(rssi, pa.float32()),
+        pa.array(ts, pa.float64()),
+        pa.array(adapter, pa.uint8()),
+    ], schema=SCHEMA)
+
+    pq.write_table(table, filename, row_group_size=ROW_GROUP, compression=COMPRESSION,
+                   use_dictionary=['MACID'], write_statistics=True)
+
+
+def archive_capture(filename, root):
+    '''
+    Archives a .btlog capture under root, one session per capture file
+    '''
+    records, macs = open_capture(filename)
+    session = os.path.basename(filename).removesuffix('.btlog')
+
+    return write(root, records['device'], macs, decode_rssi(records['rssi']), records['time'],
+                 records['adapter'], session)
+
+
+def archive_snapshot(snapshot, root, session=None):
+    '''
+    Archives the live window of a SampleStore snapshot under root
+    '''
+    first, end, _ = snapshot.span()
+    device, rssi, ts, adapter = snapshot.read(first, end)
+
+    if session is None:
+        session = str(time.time())
+
+    return write(root, device, snapshot.devices.mac_array(), rssi, ts, adapter, session)
+
+
+def query(macs=None, since=None, until=None):
+    '''
+    Returns the filter for samples of macs (any MAC if None) from since up
+    to until. Conditions on the date and bucket partitions are included so
+    whole directories are skipped, the rest are checked against each row
+    group's statistics before it is read.
+    '''
+    conditions = []
+
+    if since is not None:
+        conditions += [ds.field('Time') >= since, ds.field('date') >= day(since)]
+
+    if until is not None:
+        conditions += [ds.field('Time') < until, ds.field('date') <= day(until)]
+
+    if macs is not None:
+        macs = list(macs)
+        conditions += [ds.field('MACID').isin(macs),
+                       ds.field('bucket').isin(sorted({bucket(mac) for mac in macs}))]
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    return expression
+
+
+def read(root, macs=None, since=None, until=None, columns=('MACID', 'RSSI', 'Time', 'Adapter')):
+    '''
+    Returns an Arrow table of the archived samples of macs from since up to
+    until, in time order
+    '''
+    dataset = ds.dataset(root, format='parquet', partitioning=PARTITIONING)
+    table = dataset.to_table(columns=list(columns), filter=query(macs, since, until))
+
+    if 'Time' in columns:
+        table = table.sort_by('Time')
+
+    return table
+
+
+def to_frame(root, macs=None, since=None, until=None):
+    '''
+    Loads archived samples as a DataFrame with the MACID, RSSI, Time and
+    Adapter columns of the CSV logs
+    '''
+    frame = read(root, macs, since, until).to_pandas()
+    frame['MACID'] = frame['MACID'].astype(object)
+
+    return frame
+
+
+def parse_time(text):
+    # Seconds since the epoch, or an ISO date and time taken as UTC if it
+    # has no zone
+    try:
+        return float(text)
+    except ValueError:
+        t = datetime.fromisoformat(text)
+
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+
+        return t.timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BTScan capture archive")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help="archive .btlog captures")
+    add.add_argument('root', help="archive directory")
+    add.add_argument('captures', nargs='+', metavar='CAPTURE', help=".btlog capture files")
+
+    find = commands.add_parser('query', help="read samples back out of the archive")
+    find.add_argument('root', help="archive directory")
+    find.add_argument('--mac', action='append', dest='macs', help="MAC to read; repeat for several")
+    find.add_argument('--since', type=parse_time, help="epoch seconds or ISO time")
+    find.add_argument('--until', type=parse_time, help="epoch seconds or ISO time")
+    find.add_argument('--out', help="write the samples to this .csv or .parquet file")
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        for capture in args.captures:
+            files = archive_capture(capture, args.root)
+            print(f"Archived {capture} to {files} files in {args.root}")
+        sys.exit(0)
+
+    frame = to_frame(args.root, args.macs, args.since, args.until)
+
+    if args.out is None:
+        print(frame)
+    elif args.out.endswith('.parquet'):
+        frame.to_parquet(args.out, index=False)
+    else:
+        frame.to_csv(args.out, index=False)
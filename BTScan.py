@@ -1,25 +1,46 @@
 import os
 import time
-import pandas as pd
-import customtkinter as ctk
-import matplotlib.pyplot as plt
+import argparse
 from threading import Thread
-from gi.repository import GLib
-from pydbus import SystemBus
+from StartupTimer import StartupTimer
+startup = StartupTimer()
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
-from AntennaGUI import AntennaGUI
-from SignalGUI import SignalGUI
-from WaterfallGUI import WaterfallGUI
+from SampleStore import SampleStore
+from Rollups import Retention
+from Smoothing import Smoother
+from Clustering import DeviceClusters
+from RenderScheduler import RenderScheduler
+from Metrics import metrics, MetricsLog
+
+# Tk, matplotlib, pandas and the D-Bus modules are imported where they are
+# first needed, and each view only when it is first shown, so the window
+# comes up as soon as it can
+
+
+def view_class(name):
+    if name == 'antenna':
+        from AntennaGUI import AntennaGUI
+        return AntennaGUI
+
+    if name == 'signal':
+        from SignalGUI import SignalGUI
+        return SignalGUI
+
+    from WaterfallGUI import WaterfallGUI
+    return WaterfallGUI
 
 
 class ctkApp:
-    def __init__(self):
+    def __init__(self, startup=None, show_metrics=False):
+        import customtkinter as ctk
+
         # Constants
-        global x
         self.WIDTH=1200
         self.HEIGHT=900
         self.QUIT = False
+        # Target frame rate for each view
+        self.FPS = {'antenna': 10, 'signal': 30, 'waterfall': 30}
 
         # GUI particulars
         ctk.set_appearance_mode("dark")
@@ -28,46 +49,98 @@ class ctkApp:
         self.root.title("BTScan")
         self.root.update()
         self.swap_view_toggle = False
+        # Reported once the first frame is drawn
+        self.startup = startup
+        self.show_metrics = show_metrics
 
         # The display for the antenna view
-        self.hud = AntennaGUI(
-            self.root, x,
+        snapshot = store.snapshot()
+        store.stats.update(snapshot=snapshot)
+        self.update_clusters(snapshot)
+        self.hud = view_class('antenna')(
+            self.root, snapshot,
             quit=self.quit,
             toggle_update=self.toggle_update,
             toggle_view=self.toggle_view,
             reset=self.reset_data,
             save=self.save_data
         )
+        self.add_overlay()
 
         self.current_hud = 'antenna' # 'antenna', 'signal' or 'waterfall'
 
+        self.last_span = None
+        self.scheduler = RenderScheduler(
+            self.root, self.update_window,
+            changed=self.data_changed,
+            fps=self.FPS[self.current_hud]
+        )
+
     def run(self):
         # Loop
-        self.update_window()
+        self.scheduler.start()
         self.root.mainloop()
 
-    def update_window(self):
-        # Update the hud, repeats every 100ms
-        self.root.update()
+    def data_changed(self):
+        span = store.span()
+        changed = span != self.last_span
+        self.last_span = span
+
+        return changed
 
+    def update_window(self):
+        # Update the hud, called by the scheduler for each frame
         if self.hud.UPDATE:
-            self.hud.update(x)
+            # One snapshot per frame, so everything drawn agrees, however
+            # much the scanner appends meanwhile
+            snapshot = store.snapshot()
+            with metrics.timer('stats.update'):
+                store.stats.update(snapshot=snapshot)
+            with metrics.timer('clusters.update'):
+                self.update_clusters(snapshot)
+
+            with metrics.timer('draw.' + self.current_hud):
+                self.hud.update(snapshot)
+                # Draw now rather than when Tk is idle, so the scheduler
+                # sees how long drawing really takes
+                self.root.update_idletasks()
+
+            if metrics.enabled:
+                metrics.count('frames')
+                metrics.gauge('store.samples', len(snapshot))
+                metrics.gauge('store.devices', snapshot.n_devices)
+
+            if self.overlay is not None:
+                self.overlay.update(metrics.last)
+
+            if self.startup is not None:
+                self.startup.mark('first frame')
+                self.startup.report()
+                self.startup = None
 
         if self.swap_view_toggle:
             self.swap_view()
             self.swap_view_toggle = False
+            self.scheduler.set_fps(self.FPS[self.current_hud])
 
-        if not self.QUIT:
-            if self.current_hud == 'antenna':
-                self.root.after(100, self.update_window)
-            elif self.current_hud == 'signal':
-                self.root.after(4, self.update_window)
-            elif self.current_hud == 'waterfall':
-                self.root.after(4, self.update_window)
-        else:
+        if self.QUIT:
+            self.scheduler.stop()
             self.root.quit()
             self.root.destroy()
 
+    def update_clusters(self, snapshot):
+        # After the stats, whose windows it matches RSSI with
+        if store.clusters is not None:
+            store.clusters.update(snapshot)
+
+    def add_overlay(self):
+        # Views clear the window when they go, so each new one gets its own
+        self.overlay = None
+
+        if self.show_metrics:
+            from MetricsOverlay import MetricsOverlay
+            self.overlay = MetricsOverlay(self.root)
+
     def toggle_update(self):
         if self.hud.UPDATE:
             self.hud.UPDATE = False
@@ -77,139 +150,258 @@ class ctkApp:
     def toggle_view(self, selection):
         self.swap_view_toggle = True
         self.current_hud = selection
+        self.scheduler.request()
 
     def swap_view(self):
         self.hud.destroy()
+        snapshot = store.snapshot()
+        store.stats.update(snapshot=snapshot)
+        self.update_clusters(snapshot)
 
         if self.current_hud == 'antenna':
-            self.hud = AntennaGUI(
-                self.root, x,
+            self.hud = view_class('antenna')(
+                self.root, snapshot,
                 quit=self.quit,
                 toggle_update=self.toggle_update,
                 toggle_view=self.toggle_view,
-                reset=self.reset_data
+                reset=self.reset_data,
+                save=self.save_data
             )
 
         elif self.current_hud == 'signal':
-            self.hud = SignalGUI(
-                self.root, x,
+            self.hud = view_class('signal')(
+                self.root, snapshot,
                 quit=self.quit,
                 toggle_update=self.toggle_update,
                 toggle_view=self.toggle_view
             )
 
         elif self.current_hud == 'waterfall':
-            self.hud = WaterfallGUI(
-                self.root, x,
+            self.hud = view_class('waterfall')(
+                self.root, snapshot,
+                depth=WATERFALL_DEPTH,
+                columns=WATERFALL_COLUMNS,
+                rank=WATERFALL_RANK,
                 quit=self.quit,
                 toggle_view=self.toggle_view
             )
 
+        self.add_overlay()
+
     def optionmenu_callback(self, choice):
         print("optionmenu dropdown clicked:", choice)
 
     def quit(self):
         self.QUIT = True
+        self.scheduler.request()
 
     def reset_data(self):
-        global x
+        # Anything not yet saved would be lost with the reset
+        if capture is not None:
+            capture.flush()
 
-        x = pd.DataFrame({
-            "MACID": [],
-            "RSSI": [],
-            "Time": []
-        })
+        store.clear()
 
     def save_data(self):
-        now = time.time()
-        filename = "BTScan_log_" + str(now) + ".csv"
-        x.to_csv(filename, index=False)
+        # Write what we have so far and keep appending from then on
+        global capture
+        from CaptureLog import CaptureWriter
 
-        print(f"Data saved as {os.getcwd() + '/' + filename}")
+        if capture is None:
+            now = time.time()
+            filename = "BTScan_log_" + str(now) + ".btlog"
+            capture = CaptureWriter(store, filename)
+            capture.start()
+
+        print(f"Data saving to {os.path.abspath(capture.filename)}")
 
 
 # ****************** SCANNER *************************
 
 
 SCAN_TIME = 20
-DEVICE_INTERFACE = 'org.bluez.Device1'
 NULL = None
 
-remove_list = set()
-
-x = pd.DataFrame({
-    "MACID": [],
-    "RSSI": [],
-    "Time": []
-})
-
-
-def stop_scan():
-    adapter.StopDiscovery()
-    mainloop.quit()
-
-
-def clean_device(rm_dev):
-    try:
-        adapter.RemoveDevice(rm_dev)
-    except GLib.Error as err:
-        pass
-
-
-def on_iface_added(path, interfaces):
-    if DEVICE_INTERFACE in interfaces:
-        on_device_found(path, interfaces[DEVICE_INTERFACE])
+# Oldest samples are dropped once the store holds this many
+MAX_SAMPLES = 1_000_000
 
+# Raw samples are kept for this many seconds, then summarised per second
+# for an hour and per minute for a day
+HOT_SECONDS = 3600
+ROLLUP_TIERS = ((1, 3600), (60, 86400))
 
-def on_device_found(device_path, device_props):
-    global x
-    address = device_props.get('Address')
-    rssi = device_props.get('RSSI')
-    ts = time.time()
+# Distances are estimated with the log-distance path loss model: the RSSI
+# at 1 m and the path loss exponent, about 2 outdoors and 3 to 4 indoors
+TX_POWER = -59
+PATH_LOSS_EXPONENT = 2.0
 
-    # Stick the data in to our DF
-    x = pd.concat([x,
-                   pd.Series(
-                       {"MACID":address, "RSSI":rssi, "Time":ts}
-                   ).to_frame().T],
-                  ignore_index=True)
+# A new random MAC with the same payload fingerprint is taken for the same
+# device if the old one went quiet at most this many seconds before
+ROTATION_GAP = 10.0
 
-    clean_device(device_path)
+# Rows of history and the most devices in the waterfall view
+WATERFALL_DEPTH = 100
+WATERFALL_COLUMNS = 50
+# Columns go to the devices with the highest 'rate' or 'rssi'
+WATERFALL_RANK = 'rate'
 
-# *********************** ADAPTER SETUP **************************************
-
-bus = SystemBus()
-adapter = bus.get('org.bluez', '/org/bluez/hci0')
-
-mngr = bus.get('org.bluez', '/')
-mngr.onInterfacesAdded = on_iface_added
-
-mainloop = GLib.MainLoop()
+remove_list = set()
 
+store = SampleStore(max_samples=MAX_SAMPLES, hot_seconds=HOT_SECONDS,
+                    retention=Retention(ROLLUP_TIERS),
+                    smoother=Smoother(tx_power=TX_POWER, exponent=PATH_LOSS_EXPONENT),
+                    clusters=DeviceClusters(max_gap=ROTATION_GAP))
 
-# Change the default scan options
-adapter.SetDiscoveryFilter(
-    {
-        'Transport': GLib.Variant.new_string("le"),
-        'DuplicateData': GLib.Variant.new_boolean(True),
-        'RSSI': GLib.Variant.new_int16(-120)
-    }
-)
+# Set once saving starts, either from --log or the Save Data button
+capture = None
 
 # ***************************** MAIN PROGRAM **********************************
 
 if __name__ == "__main__":
-    adapter.StartDiscovery()
-    time.sleep(0.5)
-    CTK_Window = ctkApp()
+    parser = argparse.ArgumentParser(description="BTScan")
+    parser.add_argument(
+        '--scanner-process', action='store_true',
+        help="run the BlueZ scanner in its own process so ingest is not slowed down by drawing")
+    parser.add_argument(
+        '--adapter', action='append', dest='adapters',
+        help="adapter to scan with, e.g. hci1; repeat for several (default: all)")
+    parser.add_argument(
+        '--track-properties', action='store_true',
+        help="read RSSI updates from PropertiesChanged instead of removing devices")
+    parser.add_argument(
+        '--replay', metavar='FILE',
+        help="play back a saved .csv or .btlog capture, or an archive directory, instead of scanning")
+    parser.add_argument(
+        '--speed', type=float, default=1.0,
+        help="replay speed, 1 for real time or 0 for as fast as possible")
+    parser.add_argument(
+        '--loop', action='store_true',
+        help="start the replay again when it ends")
+    parser.add_argument(
+        '--log', metavar='FILE',
+        help="save every sample to a binary capture file from the start")
+    parser.add_argument(
+        '--archive', metavar='DIR',
+        help="on exit, add the session's capture (or the samples still held) to a Parquet archive")
+    parser.add_argument(
+        '--waterfall-depth', type=int, default=WATERFALL_DEPTH,
+        help="frames of history in the waterfall view")
+    parser.add_argument(
+        '--waterfall-columns', type=int, default=WATERFALL_COLUMNS,
+        help="most devices shown in the waterfall view")
+    parser.add_argument(
+        '--waterfall-rank', choices=('rate', 'rssi'), default=WATERFALL_RANK,
+        help="pick the waterfall devices by advertisement rate or mean RSSI")
+    parser.add_argument(
+        '--hot-window', type=float, default=HOT_SECONDS,
+        help="seconds of raw samples to keep before they are only kept as rollups")
+    parser.add_argument(
+        '--spill', metavar='FILE',
+        help="append rollups older than a day to this file instead of dropping them")
+    parser.add_argument(
+        '--tx-power', type=float, default=TX_POWER,
+        help="RSSI at 1 m, for the distance estimate")
+    parser.add_argument(
+        '--path-loss-exponent', type=float, default=PATH_LOSS_EXPONENT,
+        help="path loss exponent for the distance estimate")
+    parser.add_argument(
+        '--rotation-gap', type=float, default=ROTATION_GAP,
+        help="longest silence in seconds between a device's old and new random MAC")
+    parser.add_argument(
+        '--no-clusters', action='store_true',
+        help="show every MAC as its own device rather than linking rotating ones")
+    parser.add_argument(
+        '--metrics', action='store_true',
+        help="show ingest, aggregation and drawing timings over each view")
+    parser.add_argument(
+        '--metrics-log', metavar='FILE',
+        help="append the timings to FILE as one line of JSON per --metrics-interval")
+    parser.add_argument(
+        '--metrics-interval', type=float, default=1.0,
+        help="seconds between timing reports")
+    args = parser.parse_args()
+
+    store.hot_seconds = args.hot_window
+    store.retention.spill = args.spill
+    store.smoother.tx_power = args.tx_power
+    store.smoother.exponent = args.path_loss_exponent
+    store.clusters.max_gap = args.rotation_gap
+    if args.no_clusters:
+        store.clusters = None
+
+    WATERFALL_DEPTH = args.waterfall_depth
+    WATERFALL_COLUMNS = args.waterfall_columns
+    WATERFALL_RANK = args.waterfall_rank
+
+    startup.mark('imports')
+
+    metrics_log = None
+    if args.metrics or args.metrics_log:
+        metrics_log = MetricsLog(metrics, args.metrics_log, args.metrics_interval)
+        metrics_log.start()
+
+    if args.log:
+        from CaptureLog import CaptureWriter
+        capture = CaptureWriter(store, args.log)
+        capture.start()
+
+    # The D-Bus modules are only imported when scanning, so a replay runs
+    # on a machine without Bluetooth
+    if args.replay:
+        from Replay import Replay
+        scanner = Replay(store.extend, args.replay, speed=args.speed, loop=args.loop)
+    elif args.scanner_process:
+        from ScannerWorker import ScannerWorker
+        scanner = ScannerWorker(store, adapters=args.adapters, track_properties=args.track_properties)
+    else:
+        from Scanner import Scanner
+        scanner = Scanner(store.extend, args.adapters, track_properties=args.track_properties)
+
+    # Connecting to BlueZ (or spawning the worker, or loading the replay)
+    # runs while the window is built. A failure is kept for after.
+    setup_errors = []
+
+    def setup_scanner():
+        try:
+            scanner.setup()
+        except Exception as error:
+            setup_errors.append(error)
+
+    setup = Thread(target=setup_scanner, daemon=True)
+    setup.start()
+
+    CTK_Window = ctkApp(startup, show_metrics=args.metrics)
+    startup.mark('window')
+
+    setup.join()
+    if setup_errors:
+        CTK_Window.root.destroy()
+        if capture is not None:
+            capture.stop()
+        store.retention.close()
+        raise SystemExit(f"Could not start the scanner: {setup_errors[0]!r}")
+
+    startup.mark('adapters')
+    scanner.start()
 
-    data = Thread(target=mainloop.run, daemon=True)
-
-    data.start()
     CTK_Window.run()
+
+    import matplotlib.pyplot as plt
     plt.close()
-    GLib.timeout_add_seconds(0.1, stop_scan)
-    data.join()
+    scanner.stop()
 
+    if capture is not None:
+        capture.stop()
+
+    if args.archive:
+        import Archive
+        if capture is not None:
+            files = Archive.archive_capture(capture.filename, args.archive)
+        else:
+            files = Archive.archive_snapshot(store.snapshot(), args.archive)
+        print(f"Archived session to {files} files in {os.path.abspath(args.archive)}")
 
+    store.retention.close()
 
+    if metrics_log is not None:
+        metrics_log.stop()
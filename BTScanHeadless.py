@@ -0,0 +1,162 @@
+import os
+import time
+import argparse
+from threading import Thread, Lock
+from Scanner import Scanner
+from SampleStore import SampleStore
+from CaptureLog import CaptureWriter
+from Metrics import metrics, MetricsLog
+
+# Capture without the GUI: samples are streamed to disk in batches
+
+
+class HeadlessCapture:
+    def __init__(self, filename, flush_interval=1.0, stats_interval=10.0):
+        '''
+        on_batch only appends to an in-memory batch, so the GLib thread is
+        never held up by the disk. A writer thread swaps the batch out every
+        flush_interval seconds, appends it to filename in the same MACID,
+        RSSI, Time, Adapter layout as the GUI's saved logs and prints throughput
+        every stats_interval seconds.
+
+        If filename ends in .btlog the batches go through a SampleStore into
+        a binary capture instead (see CaptureLog).
+        '''
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.stats_interval = stats_interval
+
+        self.lock = Lock()
+        self.batch = []
+        self.running = False
+
+        self.writer = None
+        if filename.endswith('.btlog'):
+            self.store = SampleStore()
+            self.writer = CaptureWriter(self.store, filename)
+
+        self.total = 0
+        self.devices = set()
+
+    def on_batch(self, macs, rssis, times, adapters, payloads=None):
+        # Only binary captures keep the payloads
+        if self.writer is not None:
+            self.store.extend(macs, rssis, times, adapters, payloads)
+            return
+
+        metrics.count('ingest.events', len(macs))
+
+        with self.lock:
+            self.batch.extend(zip(macs, rssis, times, adapters))
+
+    def start(self):
+        if self.writer is not None:
+            self.writer.open()
+        else:
+            new_file = not os.path.exists(self.filename)
+            self.file = open(self.filename, 'a')
+
+            if new_file:
+                self.file.write("MACID,RSSI,Time,Adapter\n")
+
+        self.running = True
+        self.thread = Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+        if self.writer is not None:
+            self.writer.close()
+        else:
+            self.file.close()
+
+    def flush(self):
+        if self.writer is not None:
+            written = self.writer.flush()
+            self.total += written
+            return written
+
+        with self.lock:
+            batch, self.batch = self.batch, []
+
+        if batch:
+            self.file.write(''.join(
+                f"{mac},{'' if rssi is None else rssi},{ts},{adapter}\n"
+                for mac, rssi, ts, adapter in batch
+            ))
+            self.file.flush()
+
+            self.total += len(batch)
+            self.devices.update(mac for mac, _, _, _ in batch)
+
+        return len(batch)
+
+    def write_loop(self):
+        start = last_report = time.time()
+        reported = 0
+
+        while self.running:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+            now = time.time()
+            if now - last_report >= self.stats_interval:
+                self.report(now - start, (self.total - reported) / (now - last_report))
+                last_report, reported = now, self.total
+
+        self.flush()
+        self.report(time.time() - start, None)
+
+    def report(self, elapsed, rate):
+        rate = '' if rate is None else f"{rate:.1f} samples/s, "
+        devices = len(self.devices) if self.writer is None else len(self.writer.macs.log_ids)
+        print(f"[{elapsed:.0f}s] {rate}{self.total} samples, "
+              f"{devices} devices, {os.path.getsize(self.filename)} bytes written")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BTScan headless capture")
+    parser.add_argument('--out', default=f"BTScan_log_{time.time()}.csv",
+                        help="file to append samples to, a binary capture if it ends in .btlog")
+    parser.add_argument('--flush', type=float, default=1.0,
+                        help="seconds between writes to disk")
+    parser.add_argument('--stats', type=float, default=10.0,
+                        help="seconds between throughput reports")
+    parser.add_argument('--adapter', action='append', dest='adapters',
+                        help="adapter to scan with, e.g. hci1; repeat for several (default: all)")
+    parser.add_argument('--track-properties', action='store_true',
+                        help="read RSSI updates from PropertiesChanged instead of removing devices")
+    parser.add_argument('--duration', type=float, default=None,
+                        help="stop after this many seconds (default: run until interrupted)")
+    parser.add_argument('--metrics-log', metavar='FILE',
+                        help="append ingest timings to FILE as one line of JSON per --stats interval")
+    args = parser.parse_args()
+
+    capture = HeadlessCapture(args.out, args.flush, args.stats)
+    scanner = Scanner(capture.on_batch, args.adapters, track_properties=args.track_properties)
+
+    metrics_log = None
+    if args.metrics_log:
+        metrics_log = MetricsLog(metrics, args.metrics_log, args.stats)
+        metrics_log.start()
+
+    capture.start()
+    scanner.start()
+    print(f"Capturing to {os.path.abspath(args.out)}")
+
+    try:
+        if args.duration is None:
+            while True:
+                time.sleep(1)
+        else:
+            time.sleep(args.duration)
+    except KeyboardInterrupt:
+        pass
+
+    scanner.stop()
+    capture.stop()
+
+    if metrics_log is not None:
+        metrics_log.stop()
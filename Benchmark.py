@@ -0,0 +1,212 @@
+import time
+import resource
+import argparse
+import numpy as np
+from SampleStore import SampleStore
+from Rollups import Retention
+from Smoothing import Smoother
+from Clustering import DeviceClusters
+from Scanner import Scanner
+from FakeBlueZ import FakeBlueZ
+
+# Ingest and render benchmark over simulated hours of capture
+#
+#   python Benchmark.py --hours 2 --devices 300 --rate 1000
+#
+# Ingest runs anywhere. The views draw into Tk canvases, so --views needs a
+# display; on a headless node use xvfb-run, or --headless to draw into Agg
+# canvases with no Tk at all. The windows stay hidden either way.
+#
+# The scanner removes each device after every drain, as BTScan does by
+# default; --track-properties benchmarks the PropertiesChanged path instead.
+
+VIEWS = ('antenna', 'signal', 'waterfall')
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarise(name, latencies):
+    if not latencies:
+        return f"{name:<12} no samples"
+
+    ms = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+
+    return (f"{name:<12} n={len(ms):<7} p50={p50:7.2f}ms p90={p90:7.2f}ms "
+            f"p99={p99:7.2f}ms max={ms.max():7.2f}ms")
+
+
+class Benchmark:
+    def __init__(self, hours=1.0, tick=0.1, frame_every=10.0, views=(),
+                 max_samples=1_000_000, hot_seconds=None, smooth=False, clusters=False,
+                 headless=False, **fake_args):
+        '''
+        Simulates `hours` of capture in steps of `tick` simulated seconds.
+        Every tick the fake source feeds the Scanner, the batch is drained
+        into a SampleStore and the window stats are updated, as ctkApp does
+        each frame. Every frame_every simulated seconds each of the given
+        views is updated and drawn. With hot_seconds the store keeps raw
+        samples for that long and rolls older ones up, with smooth it runs
+        the RSSI filters and with clusters it links rotating MACs, as BTScan
+        does. headless draws the views into Agg canvases, without Tk, so
+        their times leave out blitting to the screen.
+        '''
+        self.hours = hours
+        self.tick = tick
+        self.frame_every = frame_every
+        self.view_names = views
+        self.headless = headless
+
+        retention = Retention() if hot_seconds else None
+        self.store = SampleStore(max_samples=max_samples, hot_seconds=hot_seconds,
+                                 retention=retention, smoother=Smoother() if smooth else None,
+                                 clusters=DeviceClusters() if clusters else None)
+        self.scanner = Scanner(self.store.extend)
+        self.fake = FakeBlueZ(self.scanner, **fake_args)
+
+        self.latencies = {name: [] for name in ('aggregate',) + tuple(views)}
+        self.memory = []
+
+    def create_views(self, snapshot):
+        import AntennaGUI
+        import SignalGUI
+        import WaterfallGUI
+
+        classes = {'antenna': AntennaGUI.AntennaGUI, 'signal': SignalGUI.SignalGUI,
+                   'waterfall': WaterfallGUI.WaterfallGUI}
+        callbacks = dict(quit=lambda: None, toggle_update=lambda: None,
+                         toggle_view=lambda view: None, reset=lambda: None, save=lambda: None)
+        self.huds = {}
+
+        if self.headless:
+            import Headless
+            Headless.use(AntennaGUI, SignalGUI, WaterfallGUI)
+            self.root = None
+        else:
+            import customtkinter as ctk
+            self.root = ctk.CTk()
+            self.root.withdraw()
+
+        for name in self.view_names:
+            if self.root is None:
+                window = Headless.Widget()
+            else:
+                window = ctk.CTkToplevel(self.root)
+                window.withdraw()
+
+            self.huds[name] = classes[name](window, snapshot, **callbacks)
+
+    def run(self):
+        sim = time.time()
+        end = sim + self.hours * 3600
+        # Let some devices appear before the views are built
+        next_frame = sim + 30
+        next_report = sim + 3600
+
+        events = 0
+        ingest_time = 0
+        wall_start = time.perf_counter()
+        self.memory.append((0, 0, peak_rss_mb()))
+
+        while sim < end:
+            t = time.perf_counter()
+            events += self.fake.advance(sim, self.tick)
+            self.scanner.drain()
+            ingest_time += time.perf_counter() - t
+            sim += self.tick
+
+            t = time.perf_counter()
+            snapshot = self.store.snapshot()
+            self.store.stats.update(now=sim, snapshot=snapshot)
+            if self.store.clusters is not None:
+                self.store.clusters.update(snapshot)
+            self.latencies['aggregate'].append(time.perf_counter() - t)
+
+            if self.view_names and sim >= next_frame:
+                if not hasattr(self, 'huds'):
+                    self.create_views(snapshot)
+
+                for name, hud in self.huds.items():
+                    t = time.perf_counter()
+                    hud.update(snapshot)
+                    if self.root is not None:
+                        self.root.update_idletasks()
+                    self.latencies[name].append(time.perf_counter() - t)
+
+                next_frame += self.frame_every
+
+            if sim >= next_report:
+                hour = len(self.memory)
+                self.memory.append((hour, len(self.store), peak_rss_mb()))
+                print(f"simulated {hour}h: {events} events, {len(self.store)} stored, "
+                      f"{self.rollups()} rollups, {peak_rss_mb():.0f} MB peak RSS")
+                next_report += 3600
+
+        if self.memory[-1][0] != self.hours:
+            self.memory.append((self.hours, len(self.store), peak_rss_mb()))
+
+        self.report(events, ingest_time, time.perf_counter() - wall_start)
+
+    def rollups(self):
+        if self.store.retention is None:
+            return 0
+
+        return sum(len(tier) for tier in self.store.retention.tiers)
+
+    def report(self, events, ingest_time, wall):
+        print()
+        print(f"Simulated {self.hours}h in {wall:.1f}s")
+        print(f"Ingest: {events} events, {events / max(ingest_time, 1e-9):,.0f} events/s")
+        print()
+        print("Per update latency")
+        for name, latencies in self.latencies.items():
+            print(summarise(name, latencies))
+        print()
+        print("Memory")
+        for hour, stored, rss in self.memory:
+            print(f"{hour:>6g}h {stored:>10} stored {rss:8.0f} MB peak RSS")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BTScan ingest and render benchmark")
+    parser.add_argument('--hours', type=float, default=1.0, help="simulated hours of capture")
+    parser.add_argument('--devices', type=int, default=200, help="number of advertisers")
+    parser.add_argument('--rate', type=float, default=500.0, help="advertisements per second")
+    parser.add_argument('--rssi-mean', type=float, default=-70.0, help="mean device RSSI")
+    parser.add_argument('--rssi-spread', type=float, default=12.0, help="spread of device mean RSSIs")
+    parser.add_argument('--rssi-noise', type=float, default=4.0, help="RSSI noise per advertisement")
+    parser.add_argument('--churn', type=float, default=0.05, help="fraction of devices replaced per minute")
+    parser.add_argument('--rotation', type=float, default=0.0,
+                        help="fraction of devices moving to a new random MAC per minute")
+    parser.add_argument('--adapters', type=int, default=1, help="number of simulated adapters")
+    parser.add_argument('--tick', type=float, default=0.1, help="simulated seconds per ingest step")
+    parser.add_argument('--frame-every', type=float, default=10.0,
+                        help="simulated seconds between view updates")
+    parser.add_argument('--views', nargs='*', choices=VIEWS, default=[],
+                        help="views to update and draw (needs a display)")
+    parser.add_argument('--headless', action='store_true',
+                        help="draw the views into Agg canvases, with no Tk or display")
+    parser.add_argument('--track-properties', action='store_true',
+                        help="read RSSI updates from PropertiesChanged instead of removing devices")
+    parser.add_argument('--max-samples', type=int, default=1_000_000,
+                        help="raw samples the store keeps at most")
+    parser.add_argument('--hot-window', type=float,
+                        help="seconds of raw samples to keep, older ones are rolled up")
+    parser.add_argument('--smooth', action='store_true',
+                        help="run the RSSI filters and distance estimate, included in the aggregate time")
+    parser.add_argument('--clusters', action='store_true',
+                        help="link rotating MACs into devices, included in the aggregate time")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    Benchmark(
+        hours=args.hours, tick=args.tick, frame_every=args.frame_every, views=tuple(args.views),
+        max_samples=args.max_samples, hot_seconds=args.hot_window, smooth=args.smooth,
+        clusters=args.clusters, headless=args.headless,
+        devices=args.devices, rate=args.rate, rssi_mean=args.rssi_mean,
+        rssi_spread=args.rssi_spread, rssi_noise=args.rssi_noise, churn=args.churn,
+        rotation=args.rotation, adapters=args.adapters,
+        track_properties=args.track_properties, seed=args.seed
+    ).run()
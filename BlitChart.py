@@ -0,0 +1,39 @@
+# Redraws only the changing artists of a figure, over a cached background
+
+
+class BlitChart:
+    def __init__(self, fig, canvas, artists):
+        '''
+        artists are drawn by update() over a copy of everything else in the
+        figure, taken after each full draw. Anything that changes the
+        background (limits, titles, a resize) needs redraw() instead.
+        '''
+        self.fig = fig
+        self.canvas = canvas
+        self.artists = artists
+        self.background = None
+
+        for artist in artists:
+            artist.set_animated(True)
+
+        canvas.mpl_connect('draw_event', self.on_draw)
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+
+    def redraw(self):
+        self.canvas.draw()
+
+    def update(self):
+        if self.background is None:
+            self.redraw()
+            return
+
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.fig.bbox)
@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import numpy as np
+from threading import Thread, Lock
+from Payloads import to_json, from_json
+
+# Append-only binary capture files
+#
+# <name>.btlog is a 16 byte header (magic, version, record size) followed by
+# fixed size records. <name>.btlog.macs is the MAC dictionary: one MAC per
+# line, line N being device N. MACs are always written before the records
+# that use them, so a capture cut short by a crash is still readable up to
+# its last whole record. <name>.btlog.payloads has a line of JSON each time a
+# device's advertisement payload changes.
+
+MAGIC = b'BTSCANLG'
+VERSION = 1
+HEADER_SIZE = 16
+
+RECORD = np.dtype([
+    ('time', '<f8'),
+    ('device', '<u4'),
+    ('rssi', 'i1'),
+    ('adapter', 'u1'),
+])
+
+# Stored in place of a missing RSSI
+NO_RSSI = 127
+
+
+def encode_rssi(rssi):
+    return np.where(np.isnan(rssi), NO_RSSI, rssi)
+
+
+def decode_rssi(rssi):
+    '''
+    Returns stored RSSIs as float32, with NaN where there was none
+    '''
+    decoded = rssi.astype(np.float32)
+    decoded[rssi == NO_RSSI] = np.nan
+
+    return decoded
+
+
+def header(magic, version, dtype):
+    return magic + np.array([version, dtype.itemsize], dtype='<u4').tobytes()
+
+
+class MacDictionary:
+    def __init__(self, filename):
+        '''
+        Writes the MAC dictionary of a capture (or a file laid out like
+        one) to filename, line N being file device N. The store's device
+        IDs start again whenever it is reset, so they are mapped to file
+        IDs by MAC.
+        '''
+        self.filename = filename
+        self.log_ids = {}
+        self.id_map = np.zeros(0, dtype=np.uint32)
+
+    def open(self, append=False):
+        # Appending carries on from the MACs already in the file
+        if append and os.path.exists(self.filename):
+            with open(self.filename) as f:
+                self.log_ids = {mac: i for i, mac in enumerate(f.read().splitlines())}
+
+        self.file = open(self.filename, 'a' if append else 'w')
+
+    def close(self):
+        self.file.close()
+
+    def reset(self):
+        # The store has been cleared
+        self.id_map = np.zeros(0, dtype=np.uint32)
+
+    def map(self, macs, n=None):
+        '''
+        Returns the file IDs indexed by store device ID for the first n
+        (default all) of the store's macs, writing out any new MACs first
+        '''
+        n = len(macs) if n is None else n
+        known = len(self.id_map)
+        if n <= known:
+            return self.id_map
+
+        new_ids = []
+        for mac in macs[known:n]:
+            log_id = self.log_ids.get(mac)
+
+            if log_id is None:
+                log_id = len(self.log_ids)
+                self.log_ids[mac] = log_id
+                self.file.write(f"{mac}\n")
+
+            new_ids.append(log_id)
+
+        self.file.flush()
+        self.id_map = np.concatenate((self.id_map, np.array(new_ids, dtype=np.uint32)))
+
+        return self.id_map
+
+
+class CaptureWriter:
+    def __init__(self, store, filename, flush_interval=1.0, from_start=True):
+        '''
+        Follows store from a background thread, appending whatever arrived
+        since the last flush to filename. With from_start the samples
+        already in the store are written first.
+        '''
+        self.store = store
+        self.filename = filename
+        self.flush_interval = flush_interval
+
+        snapshot = store.snapshot()
+        first, end, generation = snapshot.span()
+        self.head = first if from_start else end
+        self.generation = generation
+        # Number of the next payload change to write
+        self.changes_head = 0 if from_start else snapshot.n_changes
+
+        self.macs = MacDictionary(filename + '.macs')
+
+        self.lock = Lock()
+        self.running = False
+
+    def open(self):
+        self.file = open(self.filename, 'wb')
+        self.file.write(header(MAGIC, VERSION, RECORD))
+        self.macs.open()
+        self.payloads_file = open(self.filename + '.payloads', 'w')
+
+    def close(self):
+        self.file.close()
+        self.macs.close()
+        self.payloads_file.close()
+
+    def start(self):
+        # Open and flush from a background thread until stop()
+        self.open()
+        self.running = True
+        self.thread = Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.close()
+
+    def write_loop(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            return self._flush()
+
+    def _flush(self):
+        snapshot = self.store.snapshot()
+        first, end, generation = snapshot.span()
+
+        if generation != self.generation:
+            self.generation = generation
+            self.head = first
+            self.changes_head = 0
+            self.macs.reset()
+
+        self._write_payloads(snapshot)
+
+        if end <= self.head:
+            return 0
+
+        device, rssi, ts, adapter = snapshot.read(self.head, end)
+        self.head = end
+
+        # The snapshot's MACs, as a reset since it was taken starts the
+        # store's again
+        id_map = self.macs.map(snapshot.devices.macs, snapshot.n_devices)
+
+        records = np.empty(len(ts), dtype=RECORD)
+        records['time'] = ts
+        records['device'] = id_map[device]
+        records['rssi'] = encode_rssi(rssi)
+        records['adapter'] = adapter
+
+        self.file.write(records.tobytes())
+        self.file.flush()
+
+        return len(records)
+
+    def _write_payloads(self, snapshot):
+        # The few payload changes since the last flush, by MAC
+        changes = snapshot.payload_changes(self.changes_head)
+        if not changes:
+            return
+
+        macs = snapshot.devices.macs
+        self.payloads_file.write(''.join(
+            json.dumps(dict(time=ts, mac=macs[device], **to_json(snapshot.payloads.payload(payload)))) + "\n"
+            for ts, device, payload in changes
+        ))
+        self.payloads_file.flush()
+        self.changes_head = snapshot.n_changes
+
+
+def open_records(filename, magic, version, dtype, kind='capture'):
+    '''
+    Returns (records, macs) for a capture or a file laid out like one,
+    with records memory mapped so even very large files open instantly
+    '''
+    with open(filename, 'rb') as f:
+        head = f.read(HEADER_SIZE)
+
+    if head[:8] != magic:
+        raise ValueError(f"{filename} is not a BTScan {kind} file")
+
+    file_version, record_size = np.frombuffer(head[8:], dtype='<u4')
+    if file_version != version or record_size != dtype.itemsize:
+        raise ValueError(f"{filename} is {kind} version {file_version}, expected {version}")
+
+    # Ignore a partly written last record
+    n = (os.path.getsize(filename) - HEADER_SIZE) // dtype.itemsize
+
+    if n:
+        records = np.memmap(filename, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(n,))
+    else:
+        records = np.empty(0, dtype=dtype)
+
+    with open(filename + '.macs') as f:
+        macs = f.read().splitlines()
+
+    return records, macs
+
+
+def open_capture(filename):
+    return open_records(filename, MAGIC, VERSION, RECORD)
+
+
+def open_payloads(filename):
+    '''
+    Returns a capture's payload changes as a list of dicts with time, mac
+    and the payload's fields, or none for a capture made without them
+    '''
+    if not os.path.exists(filename + '.payloads'):
+        return []
+
+    with open(filename + '.payloads') as f:
+        return [from_json(json.loads(line)) for line in f if line.endswith("\n")]
+
+
+def to_frame(filename):
+    '''
+    Loads a capture as a DataFrame with the MACID, RSSI, Time and Adapter
+    columns of the CSV logs
+    '''
+    import pandas as pd
+
+    records, macs = open_capture(filename)
+
+    return pd.DataFrame({
+        "MACID": np.array(macs, dtype=object)[records['device']],
+        "RSSI": decode_rssi(records['rssi']),
+        "Time": records['time'],
+        "Adapter": records['adapter']
+    })
+
+
+def convert(filename, out):
+    '''
+    Converts a capture to CSV or, if out ends in .parquet, Parquet
+    '''
+    frame = to_frame(filename)
+
+    if out.endswith('.parquet'):
+        frame.to_parquet(out, index=False)
+    else:
+        frame.to_csv(out, index=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python CaptureLog.py CAPTURE.btlog OUT.csv|OUT.parquet")
+        sys.exit(1)
+
+    convert(sys.argv[1], sys.argv[2])
+    print(f"Converted {sys.argv[1]} to {sys.argv[2]}")
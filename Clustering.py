@@ -0,0 +1,269 @@
+import numpy as np
+from collections import deque
+from Payloads import FIELDS
+
+# Links rotating private addresses into logical devices
+#
+# Phones and tags change their random address every few minutes. The new
+# address starts just as the old one stops, with the same kind of payload
+# and at about the same signal strength, so each new MAC is matched against
+# the logical devices whose latest MAC went quiet shortly before it
+# appeared. Only devices with the same payload fingerprint are compared,
+# found through a dict, so the cost of a new MAC does not grow with the
+# number of devices seen.
+
+
+def fingerprint(mac, key):
+    '''
+    Returns the parts of a payload key (see Payloads.payload_key) that stay
+    the same when a device rotates its address, or None if the address is
+    not a rotating one or the payload says too little to go on
+    '''
+    if key is None:
+        return None
+
+    fields = dict(zip(FIELDS, key))
+    address_type = fields['AddressType']
+
+    # Public and static random addresses (top two bits 11) never rotate.
+    # Without an address type, only the 01 of a resolvable private address
+    # says the address is random at all.
+    if address_type == 'public':
+        return None
+
+    top = int(mac[:2], 16) >> 6
+    if top == 0b11:
+        return None
+    if address_type is None and top != 0b01:
+        return None
+
+    manufacturer = fields['ManufacturerData'] or ()
+    service = fields['ServiceData'] or ()
+
+    # Rotating payloads keep their company, length and message type
+    parts = (
+        fields['Name'],
+        fields['TxPower'],
+        tuple((company, len(data), data[:1]) for company, data in manufacturer),
+        tuple(uuid for uuid, _ in service),
+        fields['UUIDs'],
+    )
+
+    if not any(parts):
+        return None
+
+    return parts
+
+
+def window_stats(x, seconds):
+    '''
+    Returns the (counts, mean RSSIs) of a snapshot or store over its last
+    `seconds` window, per logical device if it has clusters and per MAC if
+    not. Either way they are indexed by device ID.
+    '''
+    window = x.stats[seconds]
+
+    if x.clusters is None:
+        return window.counts, window.means()
+
+    return x.clusters.window_stats(window)
+
+
+class DeviceClusters:
+    def __init__(self, max_gap=10.0, overlap=1.0, rssi_tolerance=10.0, window=10):
+        '''
+        Groups device IDs into logical devices, each named by the device ID
+        of its first MAC (its root).
+
+        A new MAC joins the logical device with the same fingerprint whose
+        latest MAC was last heard at most max_gap seconds before the new one
+        first was, or up to overlap seconds after, and whose mean RSSI over
+        the last `window` seconds is within rssi_tolerance dB. The closest
+        in time and RSSI wins. Each new MAC is decided overlap seconds after
+        it appears, once it is clear whether the old one has really stopped;
+        until then it stands alone.
+
+        update() only looks at new MACs and payload changes, never at every
+        sample, so it costs almost nothing once devices settle.
+        '''
+        self.max_gap = max_gap
+        self.overlap = overlap
+        self.rssi_tolerance = rssi_tolerance
+        self.window = window
+        self.generation = None
+        self.clear()
+
+    def clear(self):
+        # Root of each device, and for each root its latest MAC
+        self.root = np.zeros(0, dtype=np.int32)
+        self.current = np.zeros(0, dtype=np.int32)
+        self.members = {}
+        # Roots open to new MACs, by fingerprint, and where each is filed
+        self.index = {}
+        self.filed = {}
+        self.pending = deque()
+        self.known = 0
+        self.changes_head = 0
+        self.linked = 0
+
+    def resize(self, n_devices):
+        if len(self.root) < n_devices:
+            new = np.arange(len(self.root), n_devices, dtype=np.int32)
+            self.root = np.concatenate((self.root, new))
+            self.current = np.concatenate((self.current, new))
+
+    def count(self):
+        '''
+        Returns the number of logical devices
+        '''
+        return self.known - self.linked
+
+    def roots(self, n):
+        # Root of each of the first n devices, ones not yet seen being
+        # their own
+        if len(self.root) >= n:
+            return self.root[:n]
+
+        return np.concatenate((self.root, np.arange(len(self.root), n, dtype=np.int32)))
+
+    def root_of(self, device):
+        if device is None or device >= len(self.root):
+            return device
+
+        return int(self.root[device])
+
+    def members_of(self, device):
+        '''
+        Returns the device IDs of every MAC of device's logical device,
+        oldest first
+        '''
+        if device is None or device >= len(self.root):
+            return [device]
+
+        return self.members.get(int(self.root[device]), [device])
+
+    def sum(self, values):
+        '''
+        Totals per-device values over each logical device, indexed by root.
+        Devices that are not roots get 0.
+        '''
+        return np.bincount(self.roots(len(values)), weights=values, minlength=len(values))
+
+    def window_stats(self, window):
+        '''
+        Returns a WindowStats Window's (counts, mean RSSIs) per logical
+        device, indexed by root
+        '''
+        counts = self.sum(window.counts)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.sum(window.sums) / counts
+
+        return counts, means
+
+    def latest(self, values):
+        '''
+        Returns per-device values taken from each logical device's latest
+        MAC, indexed by root
+        '''
+        n = len(values)
+        current = self.current[:n]
+        if len(current) < n:
+            current = np.concatenate((current, np.arange(len(current), n, dtype=np.int32)))
+
+        return values[current]
+
+    def update(self, snapshot, now=None):
+        '''
+        Brings the clusters up to date with snapshot. now defaults to the
+        time of the stats it carries.
+        '''
+        if now is None:
+            now = snapshot.stats.now
+
+        if snapshot.generation != self.generation:
+            self.generation = snapshot.generation
+            self.clear()
+
+        n = snapshot.n_devices
+        self.resize(n)
+        self.pending.extend(range(self.known, n))
+        self.known = n
+
+        # A device whose latest MAC sends a new kind of payload is filed
+        # under its new fingerprint
+        for _, device, _ in snapshot.payload_changes(self.changes_head):
+            root = int(self.root[device])
+            if self.current[root] == device and root in self.filed:
+                self.file(root, self.fingerprint(snapshot, device))
+        self.changes_head = snapshot.n_changes
+
+        first_seen = snapshot.devices.first_seen
+        means = snapshot.stats[self.window].means()
+
+        while self.pending and first_seen[self.pending[0]] + self.overlap <= now:
+            device = self.pending.popleft()
+            key = self.fingerprint(snapshot, device)
+
+            if key is None:
+                continue
+
+            root = self.match(snapshot, device, key, means)
+            if root is None:
+                root = device
+            else:
+                self.link(root, device)
+
+            self.file(root, key)
+
+    def fingerprint(self, snapshot, device):
+        payloads = snapshot.payloads
+        payload = payloads.current[device] if device < len(payloads.current) else 0
+
+        return fingerprint(snapshot.devices.macs[device], payloads.keys[payload])
+
+    def match(self, snapshot, device, key, means):
+        # The best of the logical devices with the same fingerprint
+        bucket = self.index.get(key)
+        if not bucket:
+            return None
+
+        roots = np.fromiter(bucket, dtype=np.int32, count=len(bucket))
+        latest = self.current[roots]
+        first = snapshot.devices.first_seen[device]
+        last_seen = snapshot.devices.last_seen[latest]
+        gap = first - last_seen
+
+        # Too long gone to match this or any later MAC
+        for root in roots[gap > self.max_gap].tolist():
+            del bucket[root]
+            del self.filed[root]
+
+        with np.errstate(invalid='ignore'):
+            rssi_gap = np.abs(means[latest] - means[device])
+        # No recent RSSI on one side counts as a middling match
+        rssi_gap = np.where(np.isnan(rssi_gap), self.rssi_tolerance / 2, rssi_gap)
+
+        ok = ((gap >= -self.overlap) & (gap <= self.max_gap) & (rssi_gap <= self.rssi_tolerance)
+              & (snapshot.devices.first_seen[latest] < first) & (latest != device))
+        if not ok.any():
+            return None
+
+        score = np.abs(gap) / self.max_gap + rssi_gap / self.rssi_tolerance
+        return int(roots[np.flatnonzero(ok)[np.argmin(score[ok])]])
+
+    def link(self, root, device):
+        self.root[device] = root
+        self.current[root] = device
+        self.members.setdefault(root, [root]).append(device)
+        self.linked += 1
+
+    def file(self, root, key):
+        # Move root into the bucket for key
+        old = self.filed.pop(root, None)
+        if old is not None:
+            del self.index[old][root]
+
+        if key is not None:
+            self.index.setdefault(key, {})[root] = None
+            self.filed[root] = key
@@ -0,0 +1,93 @@
+import heapq
+import numpy as np
+
+# Chooses which devices get a column in the waterfall
+
+
+class ColumnSelector:
+    def __init__(self, k, rank='rate', window=10, interval=5.0, slack=0.5):
+        '''
+        Picks up to k devices by advertisement rate ('rate') or mean RSSI
+        ('rssi') over the last `window` seconds. The scores are read from
+        the store's WindowStats, which are already kept up to date as
+        samples arrive, so nothing is rescanned.
+
+        The ranking is redone at most every `interval` seconds. A device
+        keeps its column until it drops out of the top k * (1 + slack), so
+        devices near the cut do not swap back and forth. Devices that stay
+        never change column. The shown devices sit in a min-heap by score,
+        so each swap costs O(log k).
+
+        With DeviceClusters the scores are per logical device, and the
+        columns are the roots of the shown ones.
+        '''
+        self.k = k
+        self.rank = rank
+        self.window = window
+        self.interval = interval
+        self.slack = slack
+        self.reset()
+
+    def reset(self):
+        self.columns = []
+        self.last_rank = None
+
+    def scores(self, stats, clusters=None):
+        window = stats[self.window]
+
+        if clusters is None:
+            counts, means = window.counts, window.means()
+        else:
+            counts, means = clusters.window_stats(window)
+
+        if self.rank == 'rssi':
+            scores = means
+        else:
+            scores = counts / window.seconds
+
+        # Devices with nothing in the window are not ranked at all
+        return np.where((counts > 0) & ~np.isnan(scores), scores, -np.inf)
+
+    def select(self, stats, clusters=None):
+        '''
+        Returns the new list of column device IDs, or None if it is unchanged
+        '''
+        if self.last_rank is not None and stats.now - self.last_rank < self.interval:
+            return None
+        self.last_rank = stats.now
+
+        scores = self.scores(stats, clusters)
+        ranked = np.flatnonzero(scores > -np.inf)
+
+        # Only the top k plus the slack matter, best first
+        keep = int(np.ceil(self.k * (1 + self.slack)))
+        if len(ranked) > keep:
+            ranked = ranked[np.argpartition(-scores[ranked], keep - 1)[:keep]]
+        ranked = ranked[np.argsort(-scores[ranked], kind='stable')].tolist()
+
+        columns = list(self.columns)
+        shown = set(columns)
+        challengers = [device for device in ranked[:self.k] if device not in shown]
+
+        # Free columns are filled first
+        while challengers and len(columns) < self.k:
+            columns.append(challengers.pop(0))
+
+        # Then the weakest shown device gives way, if it has dropped far enough
+        kept = set(ranked)
+        heap = [(scores[device], slot) for slot, device in enumerate(columns)]
+        heapq.heapify(heap)
+
+        for device in challengers:
+            slot = heap[0][1]
+            if columns[slot] in kept:
+                break
+
+            heapq.heapreplace(heap, (scores[device], slot))
+            columns[slot] = device
+
+        if columns == self.columns:
+            return None
+
+        self.columns = columns
+        return columns
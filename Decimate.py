@@ -0,0 +1,62 @@
+import numpy as np
+
+# Reduce a time series to about as many points as there are pixels to show it
+
+
+def minmax(x, y, n):
+    '''
+    Splits x into n equal buckets and keeps the lowest and highest y in
+    each, so spikes and dropouts survive however long the series is.
+    Returns at most 2n points, in x order. x must be sorted.
+    '''
+    if len(x) <= 2 * n:
+        return x, y
+
+    edges = np.searchsorted(x, np.linspace(x[0], x[-1], n + 1)[1:-1], side='left')
+    starts = np.unique(np.concatenate(([0], edges)))
+    counts = np.diff(np.append(starts, len(x)))
+    bucket = np.repeat(np.arange(len(starts)), counts)
+
+    keep = []
+    for extreme in (np.minimum, np.maximum):
+        hits = np.flatnonzero(y == np.repeat(extreme.reduceat(y, starts), counts))
+        # The first hit in each bucket, hits are already in bucket order
+        first = np.flatnonzero(np.diff(bucket[hits], prepend=-1))
+        keep.append(hits[first])
+
+    keep = np.unique(np.concatenate(keep))
+
+    return x[keep], y[keep]
+
+
+def lttb(x, y, n):
+    '''
+    Largest triangle three buckets: keeps the first and last points and,
+    from each of n - 2 buckets in between, the point making the largest
+    triangle with the point kept before it and the mean of the next bucket.
+    Closer to the shape of the series than minmax(), but it walks the
+    buckets one by one, so it costs more.
+    '''
+    if n < 3 or len(x) <= n:
+        return x, y
+
+    edges = np.linspace(1, len(x) - 1, n - 1).astype(np.int64)
+    # Running sums, so each bucket mean is two lookups
+    cx = np.concatenate(([0], np.cumsum(x, dtype=np.float64)))
+    cy = np.concatenate(([0], np.cumsum(y, dtype=np.float64)))
+
+    keep = np.empty(n, dtype=np.int64)
+    keep[0], keep[-1] = 0, len(x) - 1
+    a = 0
+
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (hi, edges[i + 2]) if i + 2 < len(edges) else (len(x) - 1, len(x))
+        mx = (cx[nhi] - cx[nlo]) / (nhi - nlo)
+        my = (cy[nhi] - cy[nlo]) / (nhi - nlo)
+
+        area = np.abs((x[a] - mx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (my - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+
+    return x[keep], y[keep]
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Sample numbers of each device's samples, for reading one device at a time
+
+# Shared by every device with no samples left
+EMPTY = np.empty(0, dtype=np.int64)
+# Oldest sample number of a device with none
+NONE_LEFT = np.iinfo(np.int64).max
+
+
+class DeviceIndex:
+    def __init__(self, initial_capacity=16):
+        '''
+        For each device ID, a growable array of the store sample numbers of
+        its samples, in the order they arrived. Reading one device is then a
+        binary search and a slice of its own list instead of a mask over
+        every sample in the store.
+
+        self.end is the sample number up to which samples have been added,
+        and self.oldest each device's oldest sample number, so prune() only
+        visits the devices it drops samples from. A device whose samples
+        have all been pruned gives its array back.
+        '''
+        self.initial_capacity = initial_capacity
+        self.clear()
+
+    def clear(self):
+        self.numbers = []
+        self.sizes = []
+        self.oldest = np.zeros(0, dtype=np.int64)
+        self.end = 0
+
+    def _reserve(self, device, k):
+        while device >= len(self.numbers):
+            self.numbers.append(EMPTY)
+            self.sizes.append(0)
+
+        if device >= len(self.oldest):
+            grown = np.full(max(2 * len(self.oldest), device + 1), NONE_LEFT, dtype=np.int64)
+            grown[:len(self.oldest)] = self.oldest
+            self.oldest = grown
+
+        size = self.sizes[device]
+        capacity = len(self.numbers[device])
+
+        if size + k > capacity:
+            capacity = max(capacity, self.initial_capacity)
+            while size + k > capacity:
+                capacity *= 2
+
+            numbers = np.empty(capacity, dtype=np.int64)
+            numbers[:size] = self.numbers[device][:size]
+            self.numbers[device] = numbers
+
+        return size
+
+    def add(self, device, numbers):
+        '''
+        Adds a batch of samples, given as device IDs and their sample numbers
+        '''
+        if not len(device):
+            return
+
+        order = np.argsort(device, kind='stable')
+        device = device[order]
+        numbers = numbers[order]
+
+        bounds = np.flatnonzero(np.diff(device)) + 1
+        for lo, hi in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(device)]))):
+            d = int(device[lo])
+            size = self._reserve(d, hi - lo)
+            self.numbers[d][size:size + hi - lo] = numbers[lo:hi]
+            self.sizes[d] = size + hi - lo
+            if not size:
+                self.oldest[d] = numbers[lo]
+
+    def samples(self, device):
+        '''
+        Returns the sample numbers for device, oldest first
+        '''
+        if device is None or device >= len(self.numbers):
+            return np.zeros(0, dtype=np.int64)
+
+        return self.numbers[device][:self.sizes[device]]
+
+    def prune(self, first):
+        # Forget samples numbered before first. New arrays rather than a
+        # shift in place, so a reader holding an old slice is not disturbed.
+        for device in np.flatnonzero(self.oldest < first).tolist():
+            numbers = self.numbers[device][:self.sizes[device]]
+            dropped = np.searchsorted(numbers, first, side='left')
+
+            if dropped == len(numbers):
+                self.numbers[device] = EMPTY
+                self.sizes[device] = 0
+                self.oldest[device] = NONE_LEFT
+            else:
+                kept = numbers[dropped:]
+                capacity = max(self.initial_capacity, 2 * len(kept))
+                self.numbers[device] = np.empty(capacity, dtype=np.int64)
+                self.numbers[device][:len(kept)] = kept
+                self.sizes[device] = len(kept)
+                self.oldest[device] = kept[0]
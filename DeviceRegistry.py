@@ -0,0 +1,63 @@
+import numpy as np
+
+# Maps MAC addresses to compact integer device IDs
+
+
+class DeviceRegistry:
+    def __init__(self, initial_capacity=1024):
+        '''
+        Each MAC gets the next integer ID the first time it is seen. The ID
+        indexes the per-device metadata arrays, so samples only need to
+        carry the int and grouping can be done with np.bincount.
+        '''
+        self.initial_capacity = initial_capacity
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.macs = []
+        self.labels = []
+        self.first_seen = np.empty(self.initial_capacity, dtype=np.float64)
+        self.last_seen = np.empty(self.initial_capacity, dtype=np.float64)
+        self._mac_array = np.empty(0, dtype=object)
+
+    def __len__(self):
+        return len(self.macs)
+
+    def register(self, mac, ts):
+        '''
+        Returns the device ID for mac, registering it if it is new
+        '''
+        device = self.ids.get(mac)
+
+        if device is None:
+            device = len(self.macs)
+
+            if device == len(self.first_seen):
+                self.first_seen = np.resize(self.first_seen, device * 2)
+                self.last_seen = np.resize(self.last_seen, device * 2)
+
+            self.first_seen[device] = ts
+            self.macs.append(mac)
+            self.labels.append(mac[0:5] if mac else str(mac))
+            self.ids[mac] = device
+
+        self.last_seen[device] = ts
+
+        return device
+
+    def lookup(self, mac):
+        '''
+        Returns the device ID for mac, or None if it has never been seen
+        '''
+        return self.ids.get(mac)
+
+    def mac_array(self):
+        '''
+        Returns the MACs as an object array so IDs can be mapped back with
+        a single take
+        '''
+        if len(self._mac_array) != len(self.macs):
+            self._mac_array = np.array(self.macs, dtype=object)
+
+        return self._mac_array
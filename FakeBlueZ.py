@@ -0,0 +1,169 @@
+import numpy as np
+from Scanner import DEVICE_INTERFACE
+
+# Synthetic advertisement source that drives a Scanner the way BlueZ does
+
+
+class FakeBlueZ:
+    def __init__(self, scanner, devices=200, rate=500.0, rssi_mean=-70.0,
+                 rssi_spread=12.0, rssi_noise=4.0, churn=0.05, adapters=1,
+                 payload_churn=0.01, rotation=0.0, track_properties=True, seed=0):
+        '''
+        Simulates `devices` advertisers sending `rate` advertisements per
+        second in total. A few devices are much busier than the rest, as in
+        a real RF environment. Each device has its own mean RSSI drawn from
+        N(rssi_mean, rssi_spread), and each advertisement adds
+        N(0, rssi_noise) on top. churn is the fraction of devices replaced
+        by new MACs every minute.
+
+        Each device has an advertisement payload, a third of them with a
+        name. payload_churn is the fraction of advertisements that come
+        with new manufacturer data, as with rotating counters.
+
+        rotation is the fraction of devices that move to a new random MAC
+        every minute, keeping their payload type and signal strength as
+        phones do. self.identity maps every MAC to the first MAC its device
+        had.
+
+        Events reach the scanner through the same callbacks BlueZ uses:
+        InterfacesAdded the first time a device is seen, then with
+        track_properties PropertiesChanged for its RSSI after that and
+        InterfacesRemoved when it goes away. Without track_properties the
+        scanner's RemoveDevice calls are answered here, so each device is
+        announced again the next time it advertises after a drain and the
+        advertisements in between are missed, as with BlueZ. The scanner is
+        stamped with the simulated clock, so hours of capture can be
+        simulated in minutes.
+        '''
+        self.scanner = scanner
+        self.rate = rate
+        self.rssi_noise = rssi_noise
+        self.churn = churn
+        self.payload_churn = payload_churn
+        self.rotation = rotation
+        self.rng = np.random.default_rng(seed)
+
+        self.track_properties = track_properties
+        scanner.track_properties = track_properties
+        if not track_properties:
+            scanner.remove_devices = self.remove_devices
+
+        self.adapter_paths = [f'/org/bluez/hci{i}' for i in range(adapters)]
+        scanner.adapters = {path: self for path in self.adapter_paths}
+        scanner.clock = lambda: self.now
+        self.now = 0.0
+
+        self.activity = self.rng.pareto(1.5, devices) + 1
+        self.rssi_means = self.rng.normal(rssi_mean, rssi_spread, devices)
+        self.macs = [self.random_mac() for _ in range(devices)]
+        self.payloads = [self.random_payload() for _ in range(devices)]
+        self.identity = {mac: mac for mac in self.macs}
+        self.known = set()
+
+    def random_mac(self):
+        # A resolvable private address, as phones use: top two bits 01
+        octets = self.rng.integers(0, 256, 6)
+        octets[0] = 0x40 | (octets[0] & 0x3F)
+        return ':'.join(f'{b:02X}' for b in octets)
+
+    def random_payload(self):
+        company = int(self.rng.choice([6, 76, 117]))
+        kind = bytes([int(self.rng.integers(256))])
+        payload = {
+            'AddressType': 'random',
+            'ManufacturerData': {company: self.random_bytes(kind)},
+        }
+
+        if self.rng.random() < 1 / 3:
+            payload['Name'] = f'Device {self.rng.integers(10000):04d}'
+            payload['TxPower'] = int(self.rng.integers(-20, 5))
+
+        return payload
+
+    def random_bytes(self, kind):
+        # A message type byte then data that changes
+        return kind + bytes(self.rng.integers(0, 256, 7).astype(np.uint8))
+
+    def path(self, device, adapter):
+        mac = self.macs[device].replace(':', '_')
+        return f'{self.adapter_paths[adapter]}/dev_{mac}'
+
+    def advance(self, start, seconds):
+        '''
+        Emits the advertisements for the interval starting at start and
+        returns how many were sent
+        '''
+        self.replace_devices(start, seconds)
+
+        n = self.rng.poisson(self.rate * seconds)
+        times = np.sort(self.rng.uniform(start, start + seconds, n))
+        devices = self.rng.choice(len(self.macs), n, p=self.activity / self.activity.sum())
+        adapters = self.rng.integers(0, len(self.adapter_paths), n)
+        rssis = self.rssi_means[devices] + self.rng.normal(0, self.rssi_noise, n)
+        rssis = np.clip(np.round(rssis), -127, 20).astype(int)
+        new_payloads = self.rng.random(n) < self.payload_churn
+
+        for ts, device, adapter, rssi, new_payload in zip(times, devices, adapters, rssis, new_payloads):
+            self.now = ts
+            path = self.path(device, adapter)
+            changed = {'RSSI': int(rssi)}
+
+            if new_payload:
+                manufacturer = self.payloads[device]['ManufacturerData']
+                manufacturer = {company: self.random_bytes(data[:1]) for company, data in manufacturer.items()}
+                self.payloads[device]['ManufacturerData'] = manufacturer
+                changed['ManufacturerData'] = manufacturer
+
+            if path in self.known:
+                # Only a scanner tracking properties subscribes to these
+                if self.track_properties:
+                    self.scanner.on_properties_changed(
+                        'org.bluez', path, 'org.freedesktop.DBus.Properties',
+                        'PropertiesChanged', (DEVICE_INTERFACE, changed, [])
+                    )
+            else:
+                self.known.add(path)
+                self.scanner.on_iface_added(
+                    path, {DEVICE_INTERFACE: dict(Address=self.macs[device], **changed,
+                                                  **{k: v for k, v in self.payloads[device].items()
+                                                     if k not in changed})}
+                )
+
+        self.now = start + seconds
+
+        return n
+
+    def replace_devices(self, start, seconds):
+        # Swap some devices for new ones, as they leave and arrive
+        n = self.rng.binomial(len(self.macs), min(1.0, self.churn * seconds / 60))
+        self.now = start
+
+        for device in self.rng.choice(len(self.macs), n, replace=False):
+            self.forget(device)
+            self.macs[device] = self.random_mac()
+            self.payloads[device] = self.random_payload()
+            self.identity[self.macs[device]] = self.macs[device]
+
+        # And move some to new addresses
+        n = self.rng.binomial(len(self.macs), min(1.0, self.rotation * seconds / 60))
+
+        for device in self.rng.choice(len(self.macs), n, replace=False):
+            self.forget(device)
+            old = self.macs[device]
+            self.macs[device] = self.random_mac()
+            self.identity[self.macs[device]] = self.identity[old]
+
+    def forget(self, device):
+        for adapter in range(len(self.adapter_paths)):
+            path = self.path(device, adapter)
+
+            if path in self.known:
+                self.known.discard(path)
+                if self.track_properties:
+                    self.scanner.on_iface_removed(path, {DEVICE_INTERFACE: {}})
+
+    def remove_devices(self):
+        # Stands in for the scanner's RemoveDevice calls, after which BlueZ
+        # announces each device afresh
+        while self.scanner.removals:
+            self.known.discard(self.scanner.removals.popleft())
@@ -0,0 +1,62 @@
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Stand-ins for the few Tk widgets the views use, so a view can be built and
+# drawn into Agg canvases without a display, as the benchmark does
+
+
+class Widget:
+    def __init__(self, master=None, **options):
+        self.options = options
+
+    def place(self, **position):
+        pass
+
+    def configure(self, **options):
+        self.options.update(options)
+
+    def destroy(self):
+        pass
+
+    def winfo_children(self):
+        return []
+
+
+class StringVar:
+    def __init__(self, value=''):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class Canvas(FigureCanvasAgg):
+    # FigureCanvasTkAgg, drawing into memory only
+    def __init__(self, figure, master=None):
+        super().__init__(figure)
+
+    def get_tk_widget(self):
+        return Widget()
+
+
+class Widgets:
+    # The parts of customtkinter the views use
+    CTkButton = Widget
+    CTkLabel = Widget
+    CTkOptionMenu = Widget
+    StringVar = StringVar
+
+
+def use(*modules):
+    '''
+    Makes the view modules given build their widgets and canvases from the
+    stand-ins here. pyplot is switched to Agg so no figure opens a window.
+    '''
+    plt.switch_backend('agg')
+
+    for module in modules:
+        module.ctk = Widgets
+        module.FigureCanvasTkAgg = Canvas
@@ -0,0 +1,193 @@
+import json
+import time
+from math import log10
+from threading import Thread, Lock
+
+# Counters, gauges and latency histograms for the hot paths
+#
+# Everything records into the module's `metrics`. It is off until enable()
+# is called, and the hot paths check metrics.enabled before taking any
+# timings, so when off it costs one attribute lookup per call.
+
+
+# Histogram buckets are a tenth of a decade wide, from 1 us up to 100 s
+LOW = -6
+PER_DECADE = 10
+SIZE = 80
+
+
+class Histogram:
+    def __init__(self):
+        '''
+        Latencies in seconds, bucketed on a log scale so adding one is a
+        few arithmetic operations and percentiles are good to about 25%
+        '''
+        self.counts = [0] * SIZE
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        # Called per D-Bus callback, so kept to plain arithmetic
+        i = int((log10(seconds) - LOW) * PER_DECADE) if seconds > 10 ** LOW else 0
+        if i >= SIZE:
+            i = SIZE - 1
+
+        self.counts[i] += 1
+        self.n += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        # The top of the bucket the percentile falls in
+        target = p / 100 * self.n
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(10 ** (LOW + (i + 1) / PER_DECADE), self.max)
+
+        return self.max
+
+    def summary(self):
+        ms = 1000
+
+        return {
+            'count': self.n,
+            'mean_ms': self.total / self.n * ms if self.n else 0.0,
+            'p50_ms': self.percentile(50) * ms,
+            'p90_ms': self.percentile(90) * ms,
+            'p99_ms': self.percentile(99) * ms,
+            'max_ms': self.max * ms,
+        }
+
+
+class Timer:
+    # Context manager that adds its duration to a histogram
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.time(self.name, time.perf_counter() - self.start)
+
+
+class NullTimer:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    def __init__(self):
+        '''
+        count() adds to a counter, reported as a total and a rate. time()
+        adds a latency in seconds to a histogram. gauge() sets a value
+        that is reported as it stands.
+
+        report() summarises everything since the last report and starts
+        the counters and histograms again. The last one is kept in
+        self.last for the overlay.
+        '''
+        self.enabled = False
+        self.lock = Lock()
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+        self.since = time.perf_counter()
+        self.last = None
+
+    def enable(self):
+        self.since = time.perf_counter()
+        self.enabled = True
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def time(self, name, seconds):
+        if self.enabled:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+
+            histogram.add(seconds)
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def timer(self, name):
+        if self.enabled:
+            return Timer(self, name)
+
+        return NULL_TIMER
+
+    def report(self):
+        with self.lock:
+            now = time.perf_counter()
+            interval = now - self.since
+            counters, self.counters = self.counters, {}
+            timers, self.timers = self.timers, {}
+            self.since = now
+
+        report = {
+            'time': time.time(),
+            'interval': interval,
+            'counters': {name: {'count': n, 'rate': n / interval}
+                         for name, n in sorted(counters.items())},
+            'timers': {name: histogram.summary() for name, histogram in sorted(timers.items())},
+            'gauges': dict(sorted(self.gauges.items())),
+        }
+        self.last = report
+
+        return report
+
+
+metrics = Metrics()
+
+
+class MetricsLog:
+    def __init__(self, metrics, filename=None, interval=1.0):
+        '''
+        Calls metrics.report() every interval seconds from a background
+        thread, appending each one to filename as a line of JSON if given
+        '''
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self.running = False
+
+    def start(self):
+        self.metrics.enable()
+        self.file = open(self.filename, 'a') if self.filename else None
+        self.running = True
+        self.thread = Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+        if self.file is not None:
+            self.file.close()
+
+    def write_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            report = self.metrics.report()
+
+            if self.file is not None:
+                self.file.write(json.dumps(report) + "\n")
+                self.file.flush()
@@ -0,0 +1,43 @@
+import customtkinter as ctk
+
+# A corner of the window showing the latest Metrics report
+
+
+class MetricsOverlay:
+    def __init__(self, root):
+        self.label = ctk.CTkLabel(
+            master=root,
+            text="metrics pending",
+            justify='left',
+            anchor='w',
+            font=("Roboto", 12))
+        self.label.place(relx=0.55, rely=0.95)
+        self.shown = None
+
+    def update(self, report):
+        # Reports only change once an interval
+        if report is None or report is self.shown:
+            return
+
+        self.shown = report
+        self.label.configure(text=summary(report))
+
+
+def summary(report):
+    counters, timers, gauges = report['counters'], report['timers'], report['gauges']
+
+    def rate(name):
+        return counters.get(name, {}).get('rate', 0.0)
+
+    def ms(name, stat='p50_ms'):
+        return timers.get(name, {}).get(stat, 0.0)
+
+    draw = [name for name in timers if name.count('.') == 1 and name.startswith('draw.')]
+    draw_ms = max((ms(name) for name in draw), default=0.0)
+    draw_p99 = max((ms(name, 'p99_ms') for name in draw), default=0.0)
+
+    return (f"{rate('ingest.events'):,.0f} ev/s  {rate('frames'):.1f} fps  "
+            f"stats {ms('stats.update'):.1f} ms  draw {draw_ms:.1f}/{draw_p99:.1f} ms p50/p99\n"
+            f"{gauges.get('store.samples', 0):,} samples  {gauges.get('store.devices', 0):,} devices  "
+            f"callback {ms('dbus.callback', 'p99_ms') * 1000:.0f} us p99  "
+            f"remove {ms('bluez.remove'):.1f} ms  delay {ms('ingest.delay', 'p99_ms'):.0f} ms p99")
@@ -0,0 +1,173 @@
+import numpy as np
+
+# Deduplicated advertisement payloads
+#
+# Alongside RSSI, BlueZ reports a device's name, manufacturer and service
+# data, service UUIDs, TxPower and address type. These rarely change, so each
+# distinct payload is interned once and samples refer to it by a small
+# integer ID.
+
+# Device properties kept, in payload key order
+FIELDS = ('Name', 'AddressType', 'TxPower', 'ManufacturerData', 'ServiceData', 'UUIDs')
+
+# The payload ID of samples that carried none
+NO_PAYLOAD = 0
+
+
+def payload_key(props):
+    '''
+    Returns the payload fields of a dict of device properties as a hashable
+    tuple in FIELDS order, or None if it has none of them. Byte arrays
+    become bytes and dicts sorted tuples, so equal payloads give equal keys
+    however D-Bus delivered them.
+    '''
+    if not any(field in props for field in FIELDS):
+        return None
+
+    manufacturer = props.get('ManufacturerData')
+    service = props.get('ServiceData')
+    uuids = props.get('UUIDs')
+
+    return (
+        props.get('Name'),
+        props.get('AddressType'),
+        props.get('TxPower'),
+        None if manufacturer is None else tuple(sorted((int(k), bytes(v)) for k, v in manufacturer.items())),
+        None if service is None else tuple(sorted((str(k), bytes(v)) for k, v in service.items())),
+        None if uuids is None else tuple(sorted(uuids)),
+    )
+
+
+class PayloadStore:
+    def __init__(self):
+        '''
+        Interns payload keys (see payload_key) as they arrive with samples.
+        Payload IDs start at 1, NO_PAYLOAD standing for none.
+
+        self.current holds each device's latest payload ID, indexed by
+        device ID, and self.changes a (time, device, payload) record each
+        time that changes, so a device that keeps sending the same payload
+        costs one dict lookup per sample. It is a list rather than an array
+        as it is read and written one sample at a time. Changes are numbered
+        from the start, self.changes_offset being the number of the first
+        one still held.
+
+        Payloads are only released by compact(), as the samples using them
+        leave the store.
+        '''
+        self.clear()
+
+    def clear(self):
+        self.ids = {None: NO_PAYLOAD}
+        self.keys = [None]
+        self.current = []
+        # A new list, so a snapshot keeps the one it was taken with
+        self.changes = []
+        self.changes_offset = 0
+
+    def __len__(self):
+        return len(self.keys) - 1
+
+    def add(self, device, key, ts):
+        '''
+        Returns the payload ID of key, interning it if it is new, and
+        records it as device's payload if that has changed
+        '''
+        payload = self.ids.get(key)
+
+        if payload is None:
+            payload = len(self.keys)
+            self.keys.append(key)
+            self.ids[key] = payload
+
+        if payload != NO_PAYLOAD:
+            current = self.current
+            if device >= len(current):
+                current.extend([NO_PAYLOAD] * (device + 1 - len(current)))
+
+            if payload != current[device]:
+                current[device] = payload
+                self.changes.append((ts, device, payload))
+
+        return payload
+
+    def compact(self, payload, since):
+        '''
+        Returns a new PayloadStore without the changes before time since,
+        and without the payloads that no sample in payload (the live
+        samples' payload IDs), device's latest payload or remaining change
+        refers to. Payload IDs are renumbered and payload rewritten to
+        match. A new store rather than this one changed, so a snapshot
+        keeps the payloads its samples refer to.
+        '''
+        trim = 0
+        while trim < len(self.changes) and self.changes[trim][0] < since:
+            trim += 1
+        changes = self.changes[trim:]
+
+        used = np.zeros(len(self.keys), dtype=bool)
+        used[NO_PAYLOAD] = True
+        used[payload] = True
+        used[np.array(self.current, dtype=np.int64)] = True
+        used[np.array([p for _, _, p in changes], dtype=np.int64)] = True
+
+        # NO_PAYLOAD stays 0
+        renumber = np.cumsum(used) - 1
+        payload[:] = renumber[payload]
+        renumber = renumber.tolist()
+
+        compacted = PayloadStore()
+        compacted.keys = [key for key, keep in zip(self.keys, used.tolist()) if keep]
+        compacted.ids = {key: i for i, key in enumerate(compacted.keys)}
+        compacted.current = [renumber[p] for p in self.current]
+        compacted.changes = [(ts, device, renumber[p]) for ts, device, p in changes]
+        compacted.changes_offset = self.changes_offset + trim
+
+        return compacted
+
+    def payload(self, payload):
+        '''
+        Returns payload ID payload as a dict of the fields it has, with
+        ManufacturerData and ServiceData as dicts of bytes
+        '''
+        key = self.keys[payload]
+        if key is None:
+            return {}
+
+        fields = dict(zip(FIELDS, key))
+        for field in ('ManufacturerData', 'ServiceData'):
+            if fields[field] is not None:
+                fields[field] = dict(fields[field])
+
+        return {field: value for field, value in fields.items() if value is not None}
+
+    def device(self, device):
+        '''
+        Returns the latest payload of device, as payload() does
+        '''
+        if device is None or device >= len(self.current):
+            return {}
+
+        return self.payload(self.current[device])
+
+
+def to_json(fields):
+    # bytes as hex, so a payload() dict can be written as JSON
+    fields = dict(fields)
+
+    for field in ('ManufacturerData', 'ServiceData'):
+        if field in fields:
+            fields[field] = {str(k): v.hex() for k, v in fields[field].items()}
+
+    return fields
+
+
+def from_json(fields):
+    fields = dict(fields)
+
+    if 'ManufacturerData' in fields:
+        fields['ManufacturerData'] = {int(k): bytes.fromhex(v) for k, v in fields['ManufacturerData'].items()}
+    if 'ServiceData' in fields:
+        fields['ServiceData'] = {k: bytes.fromhex(v) for k, v in fields['ServiceData'].items()}
+
+    return fields
@@ -0,0 +1,68 @@
+import time
+
+# Drives a view's redraws from the Tk event loop at a target frame rate
+
+
+class RenderScheduler:
+    def __init__(self, root, render, changed=None, fps=10, idle_fps=1):
+        '''
+        Calls render() up to fps times a second using root.after.
+
+        A frame is skipped when changed() says nothing new has arrived,
+        except that one is drawn at least idle_fps times a second so time
+        windows keep moving. request() forces the next frame.
+
+        The time render() takes is tracked as a moving average, and the
+        interval between frames follows it with some headroom: the target
+        frame time while drawing fits, otherwise a little more than a draw
+        takes, but never slower than idle_fps. Drawing then never starves
+        Tk or the ingest thread, and a slow view still runs as fast as it
+        can draw.
+        '''
+        self.root = root
+        self.render = render
+        self.changed = changed
+        self.idle_fps = idle_fps
+        self.set_fps(fps)
+
+        self.draw_time = 0.0
+        self.last_render = 0.0
+        self.forced = False
+        self.running = False
+
+    def set_fps(self, fps):
+        self.fps = fps
+        self.interval = 1 / fps
+
+    def request(self):
+        self.forced = True
+
+    def start(self):
+        self.running = True
+        self.root.after(0, self.tick)
+
+    def stop(self):
+        self.running = False
+
+    def tick(self):
+        if not self.running:
+            return
+
+        start = time.perf_counter()
+        due = (self.forced or self.changed is None or self.changed()
+               or start - self.last_render >= 1 / self.idle_fps)
+
+        if due:
+            self.forced = False
+            self.last_render = start
+            self.render()
+
+            elapsed = time.perf_counter() - start
+            self.draw_time = 0.8 * self.draw_time + 0.2 * elapsed
+
+            self.interval = min(max(1 / self.fps, self.draw_time * 1.25), 1 / self.idle_fps)
+
+        if self.running:
+            # Always leave Tk a little time to itself between frames
+            wait = max(self.interval - (time.perf_counter() - start), 0.005)
+            self.root.after(int(wait * 1000), self.tick)
@@ -0,0 +1,146 @@
+import os
+import time
+import numpy as np
+from threading import Thread
+from CaptureLog import open_capture, open_payloads, decode_rssi
+from Payloads import payload_key
+
+# Plays a recorded capture back into the views in place of the Scanner
+
+
+def load_capture(filename):
+    '''
+    Loads a BTScan_log_*.csv or .btlog capture, or an Archive directory, as
+    time ordered (devices, macs, rssis, times, adapters, payloads), where
+    devices index into macs. payloads is None unless the capture recorded
+    payload changes, see load_payloads.
+    '''
+    if filename.endswith('.btlog'):
+        records, macs = open_capture(filename)
+        payloads = load_payloads(filename, records['device'], macs, records['time'])
+
+        return (records['device'], np.array(macs, dtype=object), decode_rssi(records['rssi']),
+                records['time'], records['adapter'], payloads)
+
+    # Only CSV captures and archives need pandas
+    import pandas as pd
+
+    if os.path.isdir(filename):
+        from Archive import to_frame
+        x = to_frame(filename)
+    else:
+        x = pd.read_csv(filename).sort_values(by="Time", kind='stable')
+
+    devices, macs = pd.factorize(x.MACID)
+    adapters = x.Adapter.to_numpy() if "Adapter" in x else np.zeros(len(x), dtype=np.int16)
+
+    return (devices, np.asarray(macs, dtype=object), x.RSSI.to_numpy(dtype=np.float32),
+            x.Time.to_numpy(dtype=np.float64), adapters, None)
+
+
+def load_payloads(filename, devices, macs, times):
+    '''
+    Returns the payload key each sample of a .btlog capture brought, None
+    for the samples that changed nothing, or None if the capture has no
+    payload changes
+    '''
+    changes = open_payloads(filename)
+    if not changes:
+        return None
+
+    ids = {mac: device for device, mac in enumerate(macs)}
+    payloads = np.full(len(times), None, dtype=object)
+    order = np.argsort(times, kind='stable')
+    ordered = times[order]
+
+    for change in changes:
+        # A change is logged with the time and MAC of the sample that
+        # brought it
+        device = ids.get(change['mac'])
+        i = np.searchsorted(ordered, change['time'])
+
+        while i < len(order) and ordered[i] == change['time']:
+            if devices[order[i]] == device:
+                payloads[order[i]] = payload_key(change)
+                break
+            i += 1
+
+    return payloads
+
+
+class Replay:
+    def __init__(self, on_batch, filename, speed=1.0, batch_interval=0.05,
+                 fast_batch=10000, loop=False):
+        '''
+        Drop-in for Scanner: start() feeds the capture to
+        on_batch(macs, rssis, times, adapters, payloads) from a background
+        thread, with the payloads of a .btlog capture that recorded them.
+
+        speed is how many seconds of capture play per second (1 for real
+        time), or 0 to play as fast as possible in batches of fast_batch.
+        Samples are re-stamped onto the wall clock so the views' time
+        windows work as they do live. With loop the capture plays again
+        whenever it ends.
+        '''
+        self.on_batch = on_batch
+        self.speed = speed
+        self.batch_interval = batch_interval
+        self.fast_batch = fast_batch
+        self.loop = loop
+        self.filename = filename
+
+        self.times = None
+        self.running = False
+
+    def setup(self):
+        # Load the capture, done by run() if it has not been already
+        (self.devices, self.macs, self.rssis, self.times, self.adapters,
+         self.payloads) = load_capture(self.filename)
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def run(self):
+        if self.times is None:
+            self.setup()
+
+        while self.running:
+            self.play()
+
+            if not self.loop:
+                break
+
+        self.running = False
+
+    def play(self):
+        n = len(self.times)
+        if not n:
+            return
+
+        t0 = self.times[0]
+        start = time.time()
+        i = 0
+
+        while self.running and i < n:
+            if self.speed:
+                elapsed = (time.time() - start) * self.speed
+                j = np.searchsorted(self.times, t0 + elapsed, side='right')
+                stamps = start + (self.times[i:j] - t0) / self.speed
+            else:
+                j = min(i + self.fast_batch, n)
+                stamps = np.full(j - i, time.time())
+
+            if j > i:
+                payloads = None if self.payloads is None else self.payloads[i:j]
+                self.on_batch(self.macs[self.devices[i:j]], self.rssis[i:j],
+                              stamps, self.adapters[i:j], payloads)
+                i = j
+
+            if self.speed:
+                time.sleep(self.batch_interval)
@@ -0,0 +1,255 @@
+import os
+import numpy as np
+from CaptureLog import MacDictionary, header, open_records
+from DeviceIndex import DeviceIndex
+
+# Per-device summaries of samples over fixed time buckets
+#
+# Samples that leave the store's hot window are summarised per second, those
+# per minute as they age, and the oldest can be spilled to disk. A spill file
+# has the layout of a capture (see CaptureLog): a 16 byte header, fixed size
+# records, and the MAC dictionary in <name>.macs.
+
+MAGIC = b'BTSCANRU'
+VERSION = 1
+
+ROLLUP = np.dtype([
+    ('time', '<f8'),
+    ('device', '<u4'),
+    ('count', '<u4'),
+    ('n', '<u4'),
+    ('min', '<f4'),
+    ('max', '<f4'),
+    ('sum', '<f8'),
+])
+
+
+def summarise(ts, device, count, n, mins, maxs, sums, seconds):
+    '''
+    Groups rows into buckets of `seconds` per device, returning ROLLUP
+    records ordered by time then device. count is every sample, n only the
+    ones with an RSSI, which min, max and sum are over.
+    '''
+    if not len(ts):
+        return np.empty(0, dtype=ROLLUP)
+
+    bucket = np.floor(ts / seconds) * seconds
+    order = np.lexsort((device, bucket))
+    bucket, device = bucket[order], device[order]
+
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (bucket[1:] != bucket[:-1]) | (device[1:] != device[:-1])
+    starts = np.flatnonzero(new)
+
+    records = np.empty(len(starts), dtype=ROLLUP)
+    records['time'] = bucket[starts]
+    records['device'] = device[starts]
+    records['count'] = np.add.reduceat(count[order], starts)
+    records['n'] = np.add.reduceat(n[order], starts)
+    # fmin and fmax skip the NaN of samples without an RSSI
+    records['min'] = np.fmin.reduceat(mins[order], starts)
+    records['max'] = np.fmax.reduceat(maxs[order], starts)
+    records['sum'] = np.add.reduceat(sums[order], starts)
+
+    return records
+
+
+def from_samples(device, rssi, ts, seconds):
+    valid = ~np.isnan(rssi)
+
+    return summarise(ts, device, np.ones(len(ts), dtype=np.uint32), valid.astype(np.uint32),
+                     rssi, rssi, np.where(valid, rssi, 0).astype(np.float64), seconds)
+
+
+def coarsen(records, seconds):
+    return summarise(records['time'], records['device'], records['count'], records['n'],
+                     records['min'], records['max'], records['sum'], seconds)
+
+
+def means(records):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return records['sum'] / records['n']
+
+
+class RollupTier:
+    def __init__(self, seconds, keep):
+        '''
+        Rollup records in buckets of `seconds`, for the last `keep` seconds.
+
+        Records are numbered in the order they were added, and self.index
+        holds each device's record numbers, so selecting one device reads
+        only its own records.
+        '''
+        self.seconds = seconds
+        self.keep = keep
+        self.index = DeviceIndex()
+        self.clear()
+
+    def clear(self):
+        self.records = np.empty(1024, dtype=ROLLUP)
+        self.size = 0
+        # Record number of position 0, and up to where the index is pruned
+        self.offset = 0
+        self.pruned = 0
+        self.index.clear()
+
+    def __len__(self):
+        return self.size
+
+    def add(self, records):
+        k = len(records)
+
+        if self.size + k > len(self.records):
+            capacity = len(self.records)
+            while self.size + k > capacity:
+                capacity *= 2
+
+            grown = np.empty(capacity, dtype=ROLLUP)
+            grown[:self.size] = self.records[:self.size]
+            self.records = grown
+
+        self.records[self.size:self.size + k] = records
+        first = self.offset + self.size
+        self.index.add(records['device'].astype(np.int64), np.arange(first, first + k))
+        self.size += k
+
+    def expire(self, now):
+        '''
+        Removes and returns the records older than keep
+        '''
+        cut = np.searchsorted(self.records['time'][:self.size], now - self.keep, side='left')
+        expired = self.records[:cut].copy()
+
+        if cut:
+            self.records[:self.size - cut] = self.records[cut:self.size]
+            self.size -= cut
+            self.offset += cut
+
+        # Expired numbers are skipped when read, and only pruned from the
+        # index once as many have gone as are kept, which keeps the pruning
+        # cost proportional to the records added
+        if self.offset - self.pruned > self.size:
+            self.index.prune(self.offset)
+            self.pruned = self.offset
+
+        return expired
+
+    def select(self, device, since=None):
+        numbers = self.index.samples(device)
+        numbers = numbers[np.searchsorted(numbers, self.offset, side='left'):]
+        records = self.records[numbers - self.offset]
+
+        if since is not None:
+            records = records[np.searchsorted(records['time'], since, side='left'):]
+
+        return records
+
+
+class Retention:
+    def __init__(self, tiers=((1, 3600), (60, 86400)), spill=None):
+        '''
+        tiers are (bucket seconds, seconds kept) from finest to coarsest.
+        Records leaving a tier are summarised into the next. Those leaving
+        the last are appended to the spill file if one is given, otherwise
+        dropped, so memory stays bounded however long a session runs.
+        '''
+        self.tiers = [RollupTier(seconds, keep) for seconds, keep in tiers]
+        self.spill = spill
+        self.file = None
+        self.macs = None
+        # The spill file as last read: (size, records, spill ID by MAC)
+        self.spilled = None
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+        if self.macs is not None:
+            self.macs.reset()
+
+    def add(self, device, rssi, ts, macs):
+        '''
+        Takes samples leaving the store, macs being the store's device list
+        '''
+        if not len(ts):
+            return
+
+        self.tiers[0].add(from_samples(device, rssi, ts, self.tiers[0].seconds))
+        now = ts[-1]
+
+        for i, tier in enumerate(self.tiers):
+            expired = tier.expire(now)
+            if not len(expired):
+                continue
+
+            if i + 1 < len(self.tiers):
+                self.tiers[i + 1].add(coarsen(expired, self.tiers[i + 1].seconds))
+            elif self.spill:
+                self.write(expired, macs)
+
+    def open(self):
+        new = not os.path.exists(self.spill)
+        self.file = open(self.spill, 'ab')
+        if new:
+            self.file.write(header(MAGIC, VERSION, ROLLUP))
+
+        # Carrying on from an existing spill file
+        self.macs = MacDictionary(self.spill + '.macs')
+        self.macs.open(append=True)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.macs.close()
+            self.file = None
+            self.macs = None
+
+    def write(self, records, macs):
+        if self.file is None:
+            self.open()
+
+        records = records.copy()
+        records['device'] = self.macs.map(macs)[records['device']]
+
+        self.file.write(records.tobytes())
+        self.file.flush()
+
+    def history(self, device, mac, since=None):
+        '''
+        Returns the rollup records for one device, oldest first, from the
+        spill file and then each tier. Buckets get finer as they get newer,
+        and one bucket can be split over more than one record.
+        '''
+        parts = []
+
+        if self.spill and os.path.exists(self.spill):
+            records, ids = self.read_spill()
+
+            if mac in ids:
+                if since is not None:
+                    records = records[np.searchsorted(records['time'], since, side='left'):]
+                records = np.array(records[records['device'] == ids[mac]])
+                records['device'] = device
+                parts.append(records)
+
+        for tier in reversed(self.tiers):
+            parts.append(tier.select(device, since))
+
+        return np.concatenate(parts) if parts else np.empty(0, dtype=ROLLUP)
+
+    def read_spill(self):
+        # Mapped again only when the spill file has grown
+        size = os.path.getsize(self.spill)
+
+        if self.spilled is None or self.spilled[0] != size:
+            records, macs = open_spill(self.spill)
+            self.spilled = (size, records, {mac: i for i, mac in enumerate(macs)})
+
+        return self.spilled[1:]
+
+
+def open_spill(filename):
+    '''
+    Returns (records, macs) for a spill file, with records memory mapped
+    '''
+    return open_records(filename, MAGIC, VERSION, ROLLUP, 'rollup')
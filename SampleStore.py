@@ -0,0 +1,258 @@
+import numpy as np
+from threading import Lock
+from DeviceRegistry import DeviceRegistry
+from DeviceIndex import DeviceIndex
+from Payloads import PayloadStore, NO_PAYLOAD
+from Rollups import ROLLUP
+from Snapshot import Snapshot
+from Metrics import metrics
+from WindowStats import WindowStats
+
+# Columnar store for the scanned advertisements
+
+
+class SampleStore:
+    def __init__(self, max_samples=1_000_000, initial_capacity=4096, windows=(5, 10, 25),
+                 hot_seconds=None, retention=None, smoother=None, clusters=None):
+        '''
+        Keeps device ID, RSSI, Time and adapter (the N of hciN) in numpy
+        arrays. MACs are interned in self.devices, so each sample only stores
+        an int32 device ID.
+
+        Appends are amortized O(1): the arrays double in size when full and,
+        once max_samples is reached, the oldest samples are dropped by moving
+        the start of the live window forward. The live window is always one
+        contiguous slice, so reading it never copies.
+
+        With hot_seconds, samples older than that behind the newest one are
+        dropped as well. hot_seconds should be at least the longest window.
+        Dropped samples are summarised into retention (a Rollups.Retention)
+        if one is given, so history can still be read through history().
+
+        self.stats keeps per-device aggregates over the given time windows
+        for the views to read, and self.index the sample numbers of each
+        device's samples. Ingest can append from another thread while the
+        views draw; they read through snapshot() so each frame sees one
+        version of the store.
+
+        Advertisement payloads (see Payloads) are interned in self.payloads
+        and each sample keeps the ID of the one it came with, or NO_PAYLOAD.
+
+        With a smoother (a Smoothing.Smoother), each of its columns is kept
+        alongside RSSI in self.columns, holding the smoothed series and
+        distance estimate for every sample.
+
+        clusters (a Clustering.DeviceClusters) groups rotating MACs into
+        logical devices for the views. Like the stats, its owner brings it
+        up to date with each snapshot.
+        '''
+        self.max_samples = max_samples
+        self.initial_capacity = initial_capacity
+        self.hot_seconds = hot_seconds
+        self.retention = retention
+        self.smoother = smoother
+        self.clusters = clusters
+        self.index = DeviceIndex()
+        self.lock = Lock()
+        self.generation = 0
+        self.clear()
+        self.stats = WindowStats(self, windows)
+
+    def clear(self):
+        with self.lock:
+            self._allocate(self.initial_capacity)
+            self.start = 0
+            self.end = 0
+            # Sample number of array position 0, so readers can refer to
+            # samples by a number that survives compaction
+            self.offset = 0
+            # Samples numbered below this have been passed to retention
+            self.rolled = 0
+            # Samples numbered below this have been smoothed
+            self.smoothed = 0
+            # New ones rather than clearing them, so a snapshot taken before
+            # the reset keeps the MACs and payloads its samples refer to
+            self.devices = DeviceRegistry()
+            self.payloads = PayloadStore()
+            self.index.clear()
+            if self.retention is not None:
+                self.retention.clear()
+            if self.smoother is not None:
+                self.smoother.reset()
+            self.generation += 1
+
+    def _allocate(self, capacity):
+        self.device = np.empty(capacity, dtype=np.int32)
+        self.rssi = np.empty(capacity, dtype=np.float32)
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.adapter = np.empty(capacity, dtype=np.int16)
+        self.payload = np.empty(capacity, dtype=np.int32)
+        # A new dict, so snapshots keep the columns they were taken with
+        names = self.smoother.columns if self.smoother is not None else ()
+        self.columns = {name: np.empty(capacity, dtype=np.float32) for name in names}
+
+    def _arrays(self):
+        return (self.device, self.rssi, self.time, self.adapter, self.payload) + tuple(self.columns.values())
+
+    def __len__(self):
+        return self.end - self.start
+
+    def extend(self, macs, rssis, times, adapters=0, payloads=None):
+        '''
+        Appends a batch of samples in one go. adapters is either one value
+        for the whole batch or one per sample. payloads, if given, holds a
+        payload key (see Payloads.payload_key) or None for each sample.
+        '''
+        if self.max_samples and len(times) > self.max_samples:
+            macs = macs[-self.max_samples:]
+            rssis = rssis[-self.max_samples:]
+            times = times[-self.max_samples:]
+            if not np.isscalar(adapters):
+                adapters = adapters[-self.max_samples:]
+            if payloads is not None:
+                payloads = payloads[-self.max_samples:]
+
+        k = len(times)
+        metrics.count('ingest.events', k)
+
+        with self.lock:
+            if self.end + k > len(self.time):
+                self._make_room(k)
+
+            s = slice(self.end, self.end + k)
+            devices = [self.devices.register(mac, ts) for mac, ts in zip(macs, times)]
+            self.device[s] = devices
+            self.rssi[s] = np.array(rssis, dtype=np.float64)
+            self.time[s] = times
+            self.adapter[s] = adapters
+
+            if payloads is None:
+                self.payload[s] = NO_PAYLOAD
+            else:
+                self.payload[s] = [self.payloads.add(device, payload, ts)
+                                   for device, payload, ts in zip(devices, payloads, times)]
+            self.end += k
+
+            if self.max_samples and self.end - self.start > self.max_samples:
+                self.start = self.end - self.max_samples
+
+            self._expire()
+
+    def _expire(self):
+        # Drop what has fallen out of the hot window. The data stays in the
+        # arrays until the next compaction, which is when it is rolled up.
+        if self.hot_seconds and self.end > self.start:
+            cutoff = self.time[self.end - 1] - self.hot_seconds
+            self.start += np.searchsorted(self.time[self.start:self.end], cutoff, side='left')
+
+    def _roll(self):
+        # Pass the dropped samples not yet summarised on to retention
+        first = self.offset + self.start
+
+        if self.retention is not None and first > self.rolled:
+            s = slice(self.rolled - self.offset, self.start)
+            self.retention.add(self.device[s], self.rssi[s], self.time[s], self.devices.macs)
+
+        self.rolled = max(self.rolled, first)
+
+    def _make_room(self, k=1):
+        # New arrays rather than shifting in place, so any view a GUI is
+        # still holding keeps pointing at valid data
+        if self.max_samples:
+            # Drop whatever the incoming samples would push past the cap
+            self.start += max(0, self.end - self.start + k - self.max_samples)
+
+        self._roll()
+
+        size = self.end - self.start
+        capacity = len(self.time)
+
+        while (size + k) * 2 > capacity:
+            capacity *= 2
+
+        if self.max_samples:
+            capacity = min(capacity, self.max_samples * 2)
+
+        old = self._arrays()
+        self._allocate(capacity)
+        for new, old in zip(self._arrays(), old):
+            new[:size] = old[self.start:self.end]
+
+        self.offset += self.start
+        self.start = 0
+        self.end = size
+        self.index.prune(self.offset)
+
+        # Payloads and payload changes go with the last samples using them
+        self.payloads = self.payloads.compact(self.payload[:size], self.time[0] if size else np.inf)
+
+    def span(self):
+        '''
+        Returns the (first, end) sample numbers of the live window and the
+        store generation, which changes whenever the store is cleared
+        '''
+        with self.lock:
+            return (self.offset + self.start, self.offset + self.end,
+                    self.generation)
+
+    def snapshot(self):
+        '''
+        Returns a Snapshot: one consistent, read-only view of the store,
+        taken without copying
+        '''
+        with self.lock:
+            self._smooth()
+            return Snapshot(self)
+
+    def _update_index(self):
+        # The index catches up when it is read rather than on every
+        # append, so ingest does not pay for it
+        first = max(self.index.end, self.offset + self.start)
+        end = self.offset + self.end
+
+        if end > first:
+            self.index.add(self.device[first - self.offset:self.end], np.arange(first, end))
+            self.index.end = end
+
+    def _smooth(self):
+        # Like the index, the smoothed columns catch up when a snapshot is
+        # taken, so the filters see a whole tick of samples in one batch
+        # and ingest does not pay for them. A flood of samples can leave
+        # them behind the end of the store for a while.
+        if self.smoother is None:
+            return
+
+        first = max(self.smoothed, self.offset + self.start)
+        end = self.offset + self.end
+
+        if end > first:
+            s = slice(first - self.offset, self.end)
+            self.smoother.resize(len(self.devices))
+            n, out = self.smoother.process(self.device[s], self.rssi[s], self.time[s])
+            for name, values in out.items():
+                self.columns[name][s.start:s.start + n] = values
+            self.smoothed = first + n
+
+    def device_numbers(self, device, generation):
+        '''
+        Returns the sample numbers of device's samples, oldest first, or
+        none if the store has been cleared since generation
+        '''
+        with self.lock:
+            if generation != self.generation:
+                return np.zeros(0, dtype=np.int64)
+
+            self._update_index()
+            return self.index.samples(device)
+
+    def history(self, device, since=None):
+        '''
+        Returns the rollup records (see Rollups.ROLLUP) of one device's
+        samples that have left the store, oldest first
+        '''
+        with self.lock:
+            if self.retention is None or device is None:
+                return np.empty(0, dtype=ROLLUP)
+
+            self._roll()
+            return self.retention.history(device, self.devices.macs[device], since)
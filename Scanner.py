@@ -0,0 +1,264 @@
+import time
+from collections import deque
+from threading import Thread
+from Metrics import metrics
+from Payloads import FIELDS, payload_key
+
+# BlueZ discovery across every adapter, handing advertisements on in batches
+
+DEVICE_INTERFACE = 'org.bluez.Device1'
+ADAPTER_INTERFACE = 'org.bluez.Adapter1'
+PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+
+
+def adapter_id(path):
+    '''
+    Returns N for an adapter path /org/bluez/hciN, or for the path of a
+    device on it
+    '''
+    return int(path.split('/')[3][3:])
+
+
+class Scanner:
+    def __init__(self, on_batch, adapters=None,
+                 batch_interval=0.05, track_properties=False, clock=time.time):
+        '''
+        on_batch is called as on_batch(macs, rssis, times, adapters,
+        payloads) from the GLib mainloop every batch_interval seconds with
+        the advertisements received since the last call, where adapters
+        holds the N of the hciN that heard each one. payloads holds each
+        one's payload key (see Payloads), or is None if none came with any.
+
+        Discovery runs with the same filter on every adapter BlueZ knows
+        about, or just the given names (e.g. ['hci0', 'hci1']). All of them
+        report through the one mainloop, so the merged batches are already
+        in time order.
+
+        The D-Bus callbacks only record the event and return. Devices are
+        removed from BlueZ (so the next advertisement is reported again) in
+        batches of asynchronous RemoveDevice calls.
+
+        With track_properties, devices are left in BlueZ instead and each
+        advertisement is read from its RSSI PropertiesChanged signal. That
+        saves the remove/re-add round trips, but BlueZ only signals when the
+        RSSI changes, so repeats at the same strength are not counted. Each
+        device's payload is then kept here and updated from the signals
+        that change it.
+
+        Nothing touches D-Bus until setup(), which run() calls if needed, so
+        the event handling can also be driven by a fake source (see
+        FakeBlueZ). clock stamps each event.
+        '''
+        self.on_batch = on_batch
+        self.adapter_names = adapters
+        self.batch_interval = batch_interval
+        self.track_properties = track_properties
+        self.clock = clock
+
+        # Filled by the D-Bus callbacks and emptied by drain(). deque appends
+        # and pops are atomic, so neither side needs a lock.
+        self.events = deque()
+        self.removals = deque()
+        self.addresses = {}
+        # Payload fields and key of each device, with track_properties
+        self.payload_fields = {}
+        self.payload_keys = {}
+
+        self.bus = None
+        self.adapters = {}
+        # Set once setup() has finished
+        self.mainloop = None
+
+    def setup(self):
+        # Connect to BlueZ and set the discovery filter on each adapter
+        from gi.repository import GLib
+        from pydbus import SystemBus
+
+        self.bus = SystemBus()
+        self.mngr = self.bus.get('org.bluez', '/')
+        self.mngr.onInterfacesAdded = self.on_iface_added
+
+        if self.adapter_names is None:
+            paths = sorted(
+                path for path, interfaces in self.mngr.GetManagedObjects().items()
+                if ADAPTER_INTERFACE in interfaces
+            )
+        else:
+            paths = ['/org/bluez/' + name for name in self.adapter_names]
+
+        self.adapters = {path: self.bus.get('org.bluez', path) for path in paths}
+
+        if self.track_properties:
+            self.mngr.onInterfacesRemoved = self.on_iface_removed
+            self.bus.subscribe(
+                iface=PROPERTIES_INTERFACE,
+                signal='PropertiesChanged',
+                arg0=DEVICE_INTERFACE,
+                signal_fired=self.on_properties_changed
+            )
+
+        # Change the default scan options
+        for adapter in self.adapters.values():
+            adapter.SetDiscoveryFilter(
+                {
+                    'Transport': GLib.Variant.new_string("le"),
+                    'DuplicateData': GLib.Variant.new_boolean(True),
+                    'RSSI': GLib.Variant.new_int16(-120)
+                }
+            )
+
+        self.mainloop = GLib.MainLoop()
+
+    def run(self):
+        # Scan in this thread until stop() is called
+        from gi.repository import GLib
+
+        if self.mainloop is None:
+            self.setup()
+
+        GLib.timeout_add(int(self.batch_interval * 1000), self.drain)
+        for adapter in self.adapters.values():
+            adapter.StartDiscovery()
+        self.mainloop.run()
+        self.drain()
+
+    def start(self):
+        # Scan in a background thread
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        from gi.repository import GLib
+
+        GLib.timeout_add(100, self.stop_scan)
+
+        if getattr(self, 'thread', None) is not None:
+            self.thread.join()
+
+    def stop_scan(self):
+        for adapter in self.adapters.values():
+            adapter.StopDiscovery()
+        self.mainloop.quit()
+
+        return False
+
+    def drain(self):
+        '''
+        Hands the recorded events to on_batch and removes the devices seen
+        since the last drain
+        '''
+        n = len(self.events)
+
+        if n:
+            macs, rssis, times, adapters, payloads = zip(*[self.events.popleft() for _ in range(n)])
+
+            # Most RSSI updates carry no payload, and then nothing downstream
+            # needs to look
+            if not any(payloads):
+                payloads = None
+
+            if metrics.enabled:
+                # How long the oldest event waited to be handed over
+                metrics.time('ingest.delay', self.clock() - times[0])
+
+            with metrics.timer('ingest.append'):
+                self.on_batch(macs, rssis, times, adapters, payloads)
+
+        if self.removals:
+            self.remove_devices()
+
+        return True
+
+    def remove_devices(self):
+        # Each device is removed once however many times it advertised
+        from gi.repository import GLib, Gio
+
+        paths = set()
+        while self.removals:
+            paths.add(self.removals.popleft())
+
+        # The send time is passed along to time the round trip
+        sent = time.perf_counter() if metrics.enabled else None
+
+        for path in paths:
+            self.bus.con.call(
+                'org.bluez', path.rsplit('/', 1)[0], ADAPTER_INTERFACE, 'RemoveDevice',
+                GLib.Variant('(o)', (path,)), None,
+                Gio.DBusCallFlags.NONE, -1, None,
+                self.on_device_removed, sent
+            )
+
+    def on_device_removed(self, con, result, sent):
+        from gi.repository import GLib
+
+        try:
+            con.call_finish(result)
+        except GLib.Error:
+            metrics.count('bluez.remove_errors')
+
+        if sent is not None:
+            metrics.time('bluez.remove', time.perf_counter() - sent)
+
+    def on_iface_added(self, path, interfaces):
+        # Other adapters may be scanning for someone else
+        if DEVICE_INTERFACE in interfaces and path.rsplit('/', 1)[0] in self.adapters:
+            self.on_device_found(path, interfaces[DEVICE_INTERFACE])
+
+    def on_iface_removed(self, path, interfaces):
+        if DEVICE_INTERFACE in interfaces:
+            self.addresses.pop(path, None)
+            self.payload_fields.pop(path, None)
+            self.payload_keys.pop(path, None)
+
+    def on_device_found(self, device_path, device_props):
+        if metrics.enabled:
+            start = time.perf_counter()
+
+        address = device_props.get('Address')
+        rssi = device_props.get('RSSI')
+        ts = self.clock()
+        payload = payload_key(device_props)
+
+        self.events.append((address, rssi, ts, adapter_id(device_path), payload))
+
+        if self.track_properties:
+            self.addresses[device_path] = address
+            self.payload_fields[device_path] = {field: device_props[field]
+                                                for field in FIELDS if field in device_props}
+            self.payload_keys[device_path] = payload
+        else:
+            self.removals.append(device_path)
+
+        if metrics.enabled:
+            metrics.time('dbus.callback', time.perf_counter() - start)
+
+    def on_properties_changed(self, sender, device_path, iface, signal, params):
+        if metrics.enabled:
+            start = time.perf_counter()
+
+        _, changed, _ = params
+
+        heard = 'RSSI' in changed or any(field in changed for field in FIELDS)
+
+        if heard and device_path.rsplit('/', 1)[0] in self.adapters:
+            address = self.addresses.get(device_path)
+
+            if address is None:
+                # Known to BlueZ before we started, the path ends in dev_XX_XX_..
+                address = device_path.rsplit('/dev_', 1)[-1].replace('_', ':')
+                self.addresses[device_path] = address
+
+            # The payload key is only rebuilt when part of it changes, and
+            # otherwise the one already made goes with each RSSI update
+            if 'RSSI' not in changed or len(changed) > 1:
+                fields = self.payload_fields.setdefault(device_path, {})
+                fields.update((field, changed[field]) for field in FIELDS if field in changed)
+                self.payload_keys[device_path] = payload_key(fields)
+
+            # A payload change without an RSSI is still recorded, as a
+            # sample with no RSSI
+            self.events.append((address, changed.get('RSSI'), self.clock(),
+                                adapter_id(device_path), self.payload_keys.get(device_path)))
+
+        if metrics.enabled:
+            metrics.time('dbus.callback', time.perf_counter() - start)
@@ -0,0 +1,86 @@
+import multiprocessing as mp
+from threading import Thread
+
+# Runs the BlueZ scanner in its own process so D-Bus handling never waits
+# on the GUI for the GIL
+
+
+def run_scanner(conn, scanner_args):
+    '''
+    Process entry point. Each batch from the Scanner is sent down conn as
+    it is drained. Sending 'stop' the other way ends the scan.
+    '''
+    # Only the worker process needs the D-Bus bindings
+    from gi.repository import GLib
+    from Scanner import Scanner
+
+    def on_batch(macs, rssis, times, adapters, payloads):
+        conn.send((macs, rssis, times, adapters, payloads))
+
+    scanner = Scanner(on_batch, **scanner_args)
+
+    def check_stop():
+        if conn.poll() and conn.recv() == 'stop':
+            scanner.stop_scan()
+            return False
+
+        return True
+
+    GLib.timeout_add(100, check_stop)
+    scanner.run()
+    conn.close()
+
+
+class ScannerWorker:
+    def __init__(self, store, **scanner_args):
+        '''
+        Drop-in for Scanner: start() and stop() the scan, with every batch
+        from the worker process appended to store by a receiver thread.
+        scanner_args are passed on to the Scanner in the worker.
+        '''
+        self.store = store
+        ctx = mp.get_context('spawn')
+        self.conn, self.child_conn = ctx.Pipe()
+
+        self.process = ctx.Process(
+            target=run_scanner,
+            args=(self.child_conn, scanner_args),
+            daemon=True
+        )
+        self.thread = Thread(target=self.receive, daemon=True)
+        self.started = False
+
+    def setup(self):
+        # Spawn the worker, which connects to BlueZ itself. Done by start()
+        # if it has not been already.
+        self.process.start()
+        # Only the worker writes to this end, so the receiver sees EOF
+        # when the worker exits
+        self.child_conn.close()
+        self.started = True
+
+    def start(self):
+        if not self.started:
+            self.setup()
+
+        self.thread.start()
+
+    def receive(self):
+        while True:
+            try:
+                macs, rssis, times, adapters, payloads = self.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            self.store.extend(macs, rssis, times, adapters, payloads)
+
+    def stop(self):
+        try:
+            self.conn.send('stop')
+        except (BrokenPipeError, OSError):
+            pass
+
+        self.process.join(timeout=2)
+
+        if self.process.is_alive():
+            self.process.terminate()
@@ -1,8 +1,10 @@
 import customtkinter as ctk
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import time
 import numpy as np
+from Clustering import window_stats
+from Decimate import minmax
+from Rollups import means
 
 
 class SignalGUI:
@@ -13,17 +15,42 @@ class SignalGUI:
                         "#7de1ac", "#03b751", "#e9f947", "#cdc90f", "#c5a709"]
         self.update_counter = 1
         self.max_graph_time = 120
-
-        # Get the strongest signal to start with for our plotting
-        strongest_sig = x.groupby('MACID').mean().sort_values(by="RSSI", ascending=False)
-        strongest_sig = strongest_sig.index[0]
-        self.MACID = strongest_sig
+        # Shown time ranges, in seconds
+        self.RANGES = {'2 min': 120, '10 min': 600, '1 hour': 3600, '6 hours': 21600}
+        # Cuts each trace down before plotting. set_lines asks it for one
+        # bucket per pixel of the axes' width, and minmax keeps the lowest
+        # and highest point of each, so at most two points per pixel.
+        # Decimate.lttb keeps one point per bucket instead.
+        self.DECIMATE = minmax
+        # Series that can be plotted, those other than the raw RSSI only if
+        # the store keeps them
+        self.SERIES = {'Raw RSSI': 'rssi', 'EMA': 'ema', 'Kalman': 'kalman',
+                       'Median': 'median', 'Distance': 'distance'}
+        self.SERIES = {label: column for label, column in self.SERIES.items()
+                       if column == 'rssi' or column in x.columns}
+        self.series = 'rssi'
+        self.smoother = x.smoother
+        # With DeviceClusters a device is shown with every MAC it has used
+        self.clusters = x.clusters
+
+        # Get the strongest signal to start with for our plotting. Before
+        # anything has been heard there is none until update() finds one.
+        self.MACID = self.strongest(x)
+        # Devices overlaid on the plot, one per colour. The stats are for
+        # the last one picked, self.MACID.
+        self.MACIDS = [] if self.MACID is None else [self.MACID]
+        self.devices = x.devices
+        # Rollups read for each shown device, by (device, generation, range)
+        self.histories = {}
         self.create_signal_hud(x, **callbacks)
 
     def create_signal_hud(self, x, **callbacks):
         # Put the plot in
         self.create_line(x, new=True)
 
+        counts, means = window_stats(x, None)
+        device = self.root_of(self.MACID)
+
         # Add buttons
         # Scan on/off button
         scan_button = ctk.CTkButton(
@@ -56,7 +83,7 @@ class SignalGUI:
         quit_button.place(relx=0.02, rely=0.18)
 
         # Dropdown Selector
-        self.selected_option = ctk.StringVar(value=self.MACID)
+        self.selected_option = ctk.StringVar(value=self.MACID or '')
 
         self.dropdown = ctk.CTkOptionMenu(
             master=self.root,
@@ -65,10 +92,31 @@ class SignalGUI:
             command=self.select_MACID)
         self.dropdown.place(relx=0.025, rely=0.3)
 
+        # Time range selector
+        self.selected_range = ctk.StringVar(value='2 min')
+
+        self.range_dropdown = ctk.CTkOptionMenu(
+            master=self.root,
+            values=list(self.RANGES),
+            variable=self.selected_range,
+            command=self.select_range)
+        self.range_dropdown.place(relx=0.4, rely=0.3)
+
+        # Series selector
+        if len(self.SERIES) > 1:
+            self.selected_series = ctk.StringVar(value='Raw RSSI')
+
+            self.series_dropdown = ctk.CTkOptionMenu(
+                master=self.root,
+                values=list(self.SERIES),
+                variable=self.selected_series,
+                command=self.select_series)
+            self.series_dropdown.place(relx=0.6, rely=0.3)
+
         # Total Signal count textbox
         self.device_name = ctk.CTkLabel(
             master=self.root,
-            text=f"Device\n{self.MACID}",
+            text=f"Device\n{self.MACID or ''}",
             width=200,
             height=100,
             font=("Roboto",18)
@@ -78,7 +126,7 @@ class SignalGUI:
         # Active Signal count textbox
         self.device_signal_count = ctk.CTkLabel(
             master=self.root,
-            text=f"Device Signal Count\n{x[x.MACID==self.MACID].shape[0]}",
+            text=f"Device Signal Count\n{0 if device is None else counts[device]}",
             width=200,
             height=100,
             font=("Roboto",18)
@@ -88,7 +136,7 @@ class SignalGUI:
         # Average Signal Strength
         self.av_rssi = ctk.CTkLabel(
             master=self.root,
-            text=f"Av. Device RSSI\n{round(x[x.MACID==self.MACID].RSSI.mean(), 1)}",
+            text=f"Av. Device RSSI\n{np.nan if device is None else round(means[device], 1)}",
             width=200,
             height=100,
             font=("Roboto",18))
@@ -97,7 +145,7 @@ class SignalGUI:
         # Average Signal Strength
         self.av_signals = ctk.CTkLabel(
             master=self.root,
-            text=f"Av. Signals per Second\n{round(x[(x.Time - time.time()) < 5].shape[0], 1)}",
+            text=f"Av. Signals per Second\n{round(x.stats[5].total()[0], 1)}",
             width=200,
             height=100,
             font=("Roboto",18))
@@ -105,41 +153,152 @@ class SignalGUI:
 
     def update(self, x):
         cutoff = 25
+        # A reset starts a new device registry
+        self.devices = x.devices
+        if self.MACID is None:
+            mac = self.strongest(x)
+            if mac is not None:
+                self.select_MACID(mac)
+        device = self.root_of(self.MACID)
+
+        counts, _ = window_stats(x, None)
+        recent_counts, recent_means = window_stats(x, cutoff)
+
+        if device is None or device >= len(counts):
+            device_count, av_rssi, av_sig = 0, np.nan, 0.0
+        else:
+            device_count = counts[device]
+            av_rssi = round(recent_means[device], 1)
+            av_sig = round(recent_counts[device] / cutoff, 1)
 
-        self.device_signal_count.configure(text=f"Device Signal Count\n{x[x.MACID==self.MACID].shape[0]}")
-
-        av_rssi = round(x[x.MACID==self.MACID].RSSI[(time.time() - x.Time) < cutoff].mean(), 1)
-        av_sig = round(x[x.MACID==self.MACID][(time.time() - x.Time) < cutoff].shape[0] / cutoff, 1)
+        self.device_signal_count.configure(text=f"Device Signal Count\n{device_count}")
         self.av_rssi.configure(text=f"Av. Device RSSI\n{av_rssi}")
         self.av_signals.configure(text=f"Av. Signals per Second\n{av_sig}")
 
         # Do this every 10 cycles
         if (self.update_counter % 10) == 0:
-            now = time.time()
+            order = np.argsort(-recent_counts, kind='stable')[0:30]
+            order = order[recent_counts[order] > 0]
 
-            counts = x[(now - x.Time) < cutoff]
-            counts = counts.groupby('MACID').count()
-            counts.RSSI = counts.RSSI / cutoff
-            counts = counts.sort_values(by="RSSI", ascending=False)
-            counts = counts.iloc[0:30, :]
-
-            self.dropdown.configure(values=counts.index.tolist())
+            self.dropdown.configure(values=[self.devices.macs[i] for i in order])
 
         self.create_line(x, new=False)
 
         self.update_counter += 1
 
+    def strongest(self, x):
+        # The MAC of the device with the highest average RSSI, if any
+        counts, means = window_stats(x, None)
+        seen = np.flatnonzero((counts > 0) & ~np.isnan(means))
+        if not len(seen):
+            return None
+
+        return x.devices.macs[seen[np.argmax(means[seen])]]
+
+    def root_of(self, mac):
+        device = self.devices.lookup(mac)
+        if self.clusters is None:
+            return device
+
+        return self.clusters.root_of(device)
+
+    def members_of(self, mac):
+        device = self.devices.lookup(mac)
+        if self.clusters is None:
+            return [device]
+
+        return self.clusters.members_of(device)
+
     def select_MACID(self, selection):
-        self.MACID = selection
+        # Picking a shown device again takes it off the plot
+        if selection in self.MACIDS and len(self.MACIDS) > 1:
+            self.MACIDS.remove(selection)
+            self.MACID = self.MACIDS[-1]
+        else:
+            if selection not in self.MACIDS:
+                self.MACIDS.append(selection)
+            # Past the palette the oldest one goes
+            self.MACIDS = self.MACIDS[-len(self.COLOURS):]
+            self.MACID = selection
+
+        self.selected_option.set(self.MACID)
         self.device_name.configure(text=f"Device\n{self.MACID}")
+        self.create_lines()
 
-    def create_line(self, x, new=True):
-        now = time.time()
+    def select_range(self, selection):
+        self.max_graph_time = self.RANGES[selection]
+        self.axl.set_xlim(-self.max_graph_time, 0)
+
+    def select_series(self, selection):
+        self.series = self.SERIES[selection]
+        self.axl.set_title("Estimated Distance Over Time" if self.series == 'distance' else "RSSI Over Time")
+        self.axl.set_ylabel("Distance (m)" if self.series == 'distance' else "RSSI")
 
-        m1 = x.MACID == self.MACID
-        m2 = now - x.Time <= self.max_graph_time
-        m3 = m1 & m2
+    def create_lines(self):
+        for line in self.lines:
+            line.remove()
 
+        self.lines = [self.axl.plot([], [], color=self.COLOURS[i], label=mac)[0]
+                      for i, mac in enumerate(self.MACIDS)]
+        self.axl.legend(loc='upper left', fontsize=9)
+
+    def set_lines(self, x):
+        # Times are shown relative to now, in seconds
+        now = x.stats.now
+        width = max(int(self.axl.bbox.width), 1)
+        histories, self.histories = self.histories, {}
+
+        for mac, line in zip(self.MACIDS, self.lines):
+            rssi, ts = self.device_arrays(x, mac, now - self.max_graph_time, width, histories)
+
+            seen = ~np.isnan(rssi)
+            ts, rssi = self.DECIMATE(ts[seen] - now, rssi[seen], width)
+            line.set_data(ts, rssi)
+
+    def history(self, x, device, since, width, histories):
+        # The rollups only change as samples leave the store, so they are
+        # read again when the range or store changes, or once the plot has
+        # scrolled by about a pixel
+        key = (device, x.generation, self.max_graph_time)
+        cached = histories.get(key)
+
+        if cached is None or since - cached[0] > self.max_graph_time / width:
+            cached = (since, x.history(device, since=since))
+        self.histories[key] = cached
+
+        history = cached[1]
+        return history[history['time'] >= since]
+
+    def device_arrays(self, x, mac, since, width, histories):
+        # The series of every MAC of mac's device, in time order
+        traces = []
+
+        for device in self.members_of(mac):
+            rssi, ts = x.device_arrays(device, since=since, column=self.series)
+
+            # Anything older than the store keeps comes from the rollups,
+            # whose averages stand in for the smoothed series too
+            history = self.history(x, device, since, width, histories)
+            if len(history):
+                older = means(history)
+                if self.series == 'distance':
+                    older = self.smoother.distance(older)
+
+                rssi = np.concatenate((older, rssi))
+                ts = np.concatenate((history['time'], ts))
+
+            traces.append((rssi, ts))
+
+        if len(traces) == 1:
+            return traces[0]
+
+        rssi = np.concatenate([rssi for rssi, _ in traces])
+        ts = np.concatenate([ts for _, ts in traces])
+        order = np.argsort(ts, kind='stable')
+
+        return rssi[order], ts[order]
+
+    def create_line(self, x, new=True):
         if new:
             # Create the graph and set the parameters
             self.figl, self.axl = plt.subplots()
@@ -147,10 +306,15 @@ class SignalGUI:
             self.canvasl = FigureCanvasTkAgg(self.figl, master=self.root)
 
             self.axl.set_title("RSSI Over Time")
-            self.axl.set_xlabel("Time")
+            self.axl.set_xlabel("Time (s)")
             self.axl.set_ylabel("RSSI")
 
-            self.graph, = self.axl.plot((np.array(x.Time[m3] - now)), np.array(x.RSSI[m3]))
+            self.axl.set_xlim(-self.max_graph_time, 0)
+            self.lines = []
+            self.create_lines()
+            self.set_lines(x)
+            self.axl.relim()
+            self.axl.autoscale_view(scalex=False)
 
             # Draw and place the graph
             self.canvasl.get_tk_widget().place(relx=0.02, rely=0.4)
@@ -158,10 +322,9 @@ class SignalGUI:
 
         else:
             # Update the graph
-            self.graph.set_ydata(x.RSSI[m3])
-            self.graph.set_xdata(x.Time[m3])
+            self.set_lines(x)
             self.axl.relim()
-            self.axl.autoscale_view()
+            self.axl.autoscale_view(scalex=False)
 
             self.figl.canvas.draw_idle()
 
@@ -0,0 +1,220 @@
+import numpy as np
+
+# Per-device RSSI filters and distance estimates
+#
+# Each filter keeps its state in arrays indexed by device ID. A batch of
+# samples is fed in rounds that take at most one sample from each device, so
+# each round is one vectorized step across every device in it, and each
+# device still sees its own samples in order.
+
+
+def grow(array, n, fill):
+    # Pads the first axis of array out to n with fill
+    if len(array) >= n:
+        return array
+
+    pad = np.full((n - len(array),) + array.shape[1:], fill, dtype=array.dtype)
+    return np.concatenate((array, pad))
+
+
+class EMA:
+    name = 'ema'
+
+    def __init__(self, tau=2.0):
+        '''
+        Exponential moving average with a time constant of tau seconds.
+        The weight of a sample depends on the time since the last one, so a
+        burst of advertisements counts for no more than a slow trickle.
+        '''
+        self.tau = tau
+        self.level = np.zeros(0)
+        self.last = np.zeros(0)
+
+    def resize(self, n):
+        self.level = grow(self.level, n, np.nan)
+        self.last = grow(self.last, n, 0)
+
+    def reset(self):
+        self.level[:] = np.nan
+
+    def step(self, device, rssi, ts):
+        level = self.level[device]
+        alpha = 1 - np.exp(-(ts - self.last[device]) / self.tau)
+
+        level = np.where(np.isnan(level), rssi, level + alpha * (rssi - level))
+        self.level[device] = level
+        self.last[device] = ts
+
+        return level
+
+
+class Kalman:
+    name = 'kalman'
+
+    def __init__(self, process_noise=1.0, measurement_noise=16.0):
+        '''
+        1-D Kalman filter on the RSSI level. process_noise is how far the
+        true level is expected to wander, in dB² per second, and
+        measurement_noise the variance of one reading.
+        '''
+        self.q = process_noise
+        self.r = measurement_noise
+        self.level = np.zeros(0)
+        self.variance = np.zeros(0)
+        self.last = np.zeros(0)
+
+    def resize(self, n):
+        self.level = grow(self.level, n, np.nan)
+        self.variance = grow(self.variance, n, 0)
+        self.last = grow(self.last, n, 0)
+
+    def reset(self):
+        self.level[:] = np.nan
+
+    def step(self, device, rssi, ts):
+        level = self.level[device]
+        new = np.isnan(level)
+
+        # Predict, then correct with the reading. A device's first reading
+        # is taken as it is.
+        variance = np.where(new, self.r, self.variance[device] + self.q * (ts - self.last[device]))
+        gain = np.where(new, 1.0, variance / (variance + self.r))
+
+        level = np.where(new, rssi, level + gain * (rssi - level))
+        self.level[device] = level
+        self.variance[device] = (1 - gain) * variance
+        self.last[device] = ts
+
+        return level
+
+
+class Median:
+    name = 'median'
+
+    def __init__(self, k=5):
+        '''
+        Median of each device's last k readings, which drops lone outliers
+        that the averaging filters would smear
+        '''
+        self.k = k
+        self.level = np.zeros(0)
+        self.recent = np.zeros((0, k))
+        self.n = np.zeros(0, dtype=np.int64)
+
+    def resize(self, n):
+        self.level = grow(self.level, n, np.nan)
+        self.recent = grow(self.recent, n, np.nan)
+        self.n = grow(self.n, n, 0)
+
+    def reset(self):
+        self.level[:] = np.nan
+        self.recent[:] = np.nan
+        self.n[:] = 0
+
+    def step(self, device, rssi, ts):
+        self.recent[device, self.n[device] % self.k] = rssi
+        self.n[device] += 1
+
+        recent = self.recent[device]
+        # Only devices with fewer than k readings need the NaN aware median
+        full = self.n[device] >= self.k
+        level = np.empty(len(device))
+        level[full] = np.median(recent[full], axis=1)
+        if not full.all():
+            level[~full] = np.nanmedian(recent[~full], axis=1)
+
+        self.level[device] = level
+
+        return level
+
+
+class Smoother:
+    def __init__(self, filters=None, tx_power=-59.0, exponent=2.0, distance_from='kalman',
+                 max_batch=20000, max_rounds=64):
+        '''
+        Runs each of filters (an EMA, a Kalman and a Median filter by
+        default) over every device's readings, and estimates distance in
+        metres from the distance_from filter with the log-distance path loss
+        model: tx_power is the RSSI at 1 m and exponent the path loss
+        exponent, about 2 in free space and 3 to 4 indoors.
+
+        self.columns names the series process() returns, one value per
+        sample. Samples without an RSSI get NaN.
+
+        A batch costs one vectorized step per round, and a batch from only a
+        few devices (a replay at full speed, say) can need thousands. So
+        process() takes at most max_batch samples and max_rounds rounds at a
+        time, and the rest waits for the next call.
+        '''
+        self.filters = [EMA(), Kalman(), Median()] if filters is None else filters
+        self.tx_power = tx_power
+        self.exponent = exponent
+        self.distance_from = distance_from
+        self.columns = [f.name for f in self.filters] + ['distance']
+        self.max_batch = max_batch
+        self.max_rounds = max_rounds
+
+    def resize(self, n_devices):
+        for f in self.filters:
+            f.resize(n_devices)
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+
+    def distance(self, rssi):
+        return 10 ** ((self.tx_power - rssi) / (10 * self.exponent))
+
+    def process(self, device, rssi, ts):
+        '''
+        Feeds a time ordered batch through every filter. Returns how many
+        of its samples were taken, n, and a dict of float32 arrays of
+        length n keyed by column name.
+        '''
+        n = min(len(ts), self.max_batch)
+        device, rssi, ts = device[:n], rssi[:n], ts[:n]
+        idx = np.flatnonzero(~np.isnan(rssi))
+
+        # Number each reading by how many of its device's come before it in
+        # the batch; round r takes every device's r'th reading
+        d = device[idx]
+        order = np.argsort(d, kind='stable')
+        sorted_d = d[order]
+        starts = np.flatnonzero(np.r_[True, sorted_d[1:] != sorted_d[:-1]])
+        rank = np.empty(len(d), dtype=np.int64)
+        rank[order] = np.arange(len(d)) - np.repeat(starts, np.diff(np.r_[starts, len(d)]))
+
+        # Stop short of the first reading that would need one round too many
+        over = np.flatnonzero(rank >= self.max_rounds)
+        if len(over):
+            n = idx[over[0]]
+            idx, rank = idx[:over[0]], rank[:over[0]]
+
+        out = {name: np.full(n, np.nan, dtype=np.float32) for name in self.columns}
+        if not len(idx):
+            return n, out
+
+        rounds = np.argsort(rank, kind='stable')
+        edges = np.searchsorted(rank[rounds], np.arange(rank.max() + 2))
+
+        rssi = rssi.astype(np.float64)
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            pos = idx[rounds[lo:hi]]
+            dev, values, times = device[pos], rssi[pos], ts[pos]
+
+            for f in self.filters:
+                out[f.name][pos] = f.step(dev, values, times)
+
+        out['distance'][idx] = self.distance(out[self.distance_from][idx])
+
+        return n, out
+
+    def levels(self):
+        '''
+        Returns a copy of each filter's latest value per device, and the
+        distance estimated from them
+        '''
+        levels = {f.name: f.level.copy() for f in self.filters}
+        levels['distance'] = self.distance(levels[self.distance_from])
+
+        return levels
@@ -0,0 +1,173 @@
+import numpy as np
+from Rollups import ROLLUP
+
+# A fixed view of a SampleStore for one render tick
+
+
+class Snapshot:
+    def __init__(self, store):
+        '''
+        Taken by SampleStore.snapshot() with the store lock held. It keeps
+        the store's current arrays and bounds, and nothing is copied.
+
+        Appends only ever write past the snapshot's end, and compaction
+        moves the store to new arrays. The arrays held here therefore never
+        change under a reader, and everything read through one snapshot
+        agrees with everything else read through it, without taking the
+        lock again.
+        '''
+        self.store = store
+        self.devices = store.devices
+        self.stats = store.stats
+        self.clusters = store.clusters
+
+        self.device, self.rssi, self.time, self.adapter = (
+            store.device, store.rssi, store.time, store.adapter)
+        self.start, self.end = store.start, store.end
+        self.offset = store.offset
+        self.generation = store.generation
+        self.n_devices = len(store.devices)
+
+        # Payload IDs per sample, and the payloads they refer to. Devices'
+        # payload changes numbered up to n_changes belong to this snapshot.
+        self.payload = store.payload
+        self.payloads = store.payloads
+        self.changes = store.payloads.changes
+        self.changes_offset = store.payloads.changes_offset
+        self.n_changes = self.changes_offset + len(self.changes)
+
+        # Smoothed series per sample, and each filter's latest value per
+        # device, if the store has a smoother
+        self.smoother = store.smoother
+        self.columns = store.columns
+        self.smoothed = store.smoothed
+        self.levels = store.smoother.levels() if store.smoother is not None else {}
+
+    def __len__(self):
+        return self.end - self.start
+
+    def span(self):
+        '''
+        Returns the (first, end) sample numbers of the live window and the
+        store generation, which changes whenever the store is cleared
+        '''
+        return self.offset + self.start, self.offset + self.end, self.generation
+
+    def read(self, first, end):
+        '''
+        Returns read-only (device, rssi, time, adapter) views of samples
+        numbered first up to end. Samples already dropped by the retention
+        cap are skipped.
+        '''
+        lo = self.start
+        hi = self.end
+        s = slice(min(max(first - self.offset, lo), hi), min(max(end - self.offset, lo), hi))
+        views = tuple(column[s] for column in (self.device, self.rssi, self.time, self.adapter))
+
+        for view in views:
+            view.flags.writeable = False
+
+        return views
+
+    def arrays(self, since=None):
+        '''
+        Returns read-only (device, rssi, time) views of the live window.
+        Samples are appended in time order, so since is found with a binary
+        search rather than a mask over the whole history.
+        '''
+        start, end = self.start, self.end
+
+        if since is not None:
+            start += np.searchsorted(self.time[start:end], since, side='left')
+
+        views = (self.device[start:end], self.rssi[start:end], self.time[start:end])
+
+        for view in views:
+            view.flags.writeable = False
+
+        return views
+
+    def device_arrays(self, device, since=None, column='rssi'):
+        '''
+        Returns (rssi, time) of one device's samples in the live window,
+        from since if given. Found through the store's index, so the cost
+        depends on how many samples that device has, not on the size of the
+        store. column picks one of the smoothed series in place of rssi.
+        '''
+        first, end, _ = self.span()
+        if since is not None:
+            first += np.searchsorted(self.time[self.start:self.end], since, side='left')
+
+        # The smoothed columns can be behind the raw ones
+        if column != 'rssi':
+            end = min(end, self.smoothed)
+
+        numbers = self.store.device_numbers(device, self.generation)
+        lo, hi = np.searchsorted(numbers, (first, end), side='left')
+        positions = numbers[lo:hi] - self.offset
+
+        values = self.rssi if column == 'rssi' else self.columns[column]
+
+        return values[positions], self.time[positions]
+
+    def device_payload(self, device):
+        '''
+        Returns the latest advertisement payload of device as a dict of the
+        fields it has (see Payloads.FIELDS)
+        '''
+        return self.payloads.device(device)
+
+    def payload_changes(self, head):
+        '''
+        Returns the (time, device, payload) changes numbered head up to
+        n_changes. Changes already dropped with their samples are skipped.
+        '''
+        return self.changes[max(head - self.changes_offset, 0):self.n_changes - self.changes_offset]
+
+    def history(self, device, since=None):
+        # Only samples older than the live window have been rolled up, so
+        # a range the window covers needs neither the lock nor the rollups
+        if since is not None and self.end > self.start and since > self.time[self.start]:
+            return np.empty(0, dtype=ROLLUP)
+
+        return self.store.history(device, since)
+
+    def last_time(self):
+        if self.end == self.start:
+            return None
+
+        return self.time[self.end - 1]
+
+    def device_stats(self, since=None):
+        '''
+        Returns per-device (counts, mean RSSI) arrays indexed by device ID,
+        counting samples with an RSSI as WindowStats does. Devices without
+        one in the window have a count of 0 and a mean of NaN.
+        '''
+        device, rssi, _ = self.arrays(since)
+        n = self.n_devices
+
+        valid = ~np.isnan(rssi)
+        counts = np.bincount(device[valid], minlength=n)
+        sums = np.bincount(device[valid], weights=rssi[valid], minlength=n)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+
+        return counts[:n], means[:n]
+
+    def frame(self):
+        '''
+        Returns the live window as a DataFrame with the MACID, RSSI, Time
+        and Adapter columns used in the saved logs
+        '''
+        import pandas as pd
+
+        s = slice(self.start, self.end)
+
+        return pd.DataFrame({
+            "MACID": self.devices.mac_array()[self.device[s]],
+            "RSSI": self.rssi[s],
+            "Time": self.time[s],
+            "Adapter": self.adapter[s]
+        })
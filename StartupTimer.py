@@ -0,0 +1,23 @@
+import time
+
+# Times the phases of startup
+
+
+class StartupTimer:
+    def __init__(self):
+        '''
+        mark(phase) records how long it has been since the last mark, or
+        since the timer was made. report() prints them all.
+        '''
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        phases = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+        print(f"Startup: {phases}, total {self.last - self.start:.2f}s")
@@ -0,0 +1,82 @@
+import numpy as np
+
+# Fixed size scrolling image of RSSI per device
+
+
+class WaterfallBuffer:
+    def __init__(self, depth, devices, fill=-100):
+        '''
+        A (depth, len(devices)) image where each push() adds a row of mean
+        RSSI per device column and drops the oldest.
+
+        Rows live in a float32 ring written twice, at head and head + depth,
+        so the rows in order oldest to newest are always one contiguous
+        slice and can be handed to matplotlib without copying.
+        '''
+        self.depth = depth
+        self.fill = fill
+        self.devices = np.zeros(0, dtype=np.int64)
+        self.buffer = np.full((2 * depth, 0), fill, dtype=np.float32)
+        self.head = 0
+        self.set_columns(devices)
+
+    def set_columns(self, devices):
+        '''
+        A device that stays in the same column keeps its history, any other
+        column starts empty
+        '''
+        devices = np.asarray(devices, dtype=np.int64)
+        n = min(len(devices), len(self.devices))
+        changed = np.ones(len(devices), dtype=bool)
+        changed[:n] = devices[:n] != self.devices[:n]
+
+        if len(devices) != len(self.devices):
+            buffer = np.full((2 * self.depth, len(devices)), self.fill, dtype=np.float32)
+            buffer[:, :n] = self.buffer[:, :n]
+            self.buffer = buffer
+
+        self.buffer[:, changed] = self.fill
+        self.devices = devices
+
+        # Column for each device ID, -1 if it is not shown
+        size = self.devices.max() + 1 if len(self.devices) else 0
+        self.column_of = np.full(size, -1, dtype=np.int64)
+        self.column_of[self.devices] = np.arange(len(self.devices))
+
+    def push(self, device, rssi):
+        '''
+        Adds a row from the samples (device IDs and RSSI) since the last push
+        '''
+        n = len(self.devices)
+
+        known = device < len(self.column_of)
+        columns = np.full(len(device), -1, dtype=np.int64)
+        columns[known] = self.column_of[device[known]]
+
+        shown = (columns >= 0) & ~np.isnan(rssi)
+        counts = np.bincount(columns[shown], minlength=n)
+        sums = np.bincount(columns[shown], weights=rssi[shown], minlength=n)
+
+        row = np.full(n, self.fill, dtype=np.float32)
+        np.divide(sums, counts, out=row, where=counts > 0, casting='unsafe')
+
+        self.buffer[self.head] = row
+        self.buffer[self.head + self.depth] = row
+        self.head = (self.head + 1) % self.depth
+
+    def view(self, rows=None):
+        '''
+        Rows oldest first, newest last. With rows given, a deeper buffer is
+        reduced to at most that many by taking the strongest reading in
+        each block of rows, so short bursts still show once downsampled.
+        '''
+        view = self.buffer[self.head:self.head + self.depth]
+
+        if rows is None or rows >= self.depth or not len(self.devices):
+            return view
+
+        factor = -(-self.depth // max(rows, 1))
+        # Drop the oldest rows that do not fill a whole block
+        view = view[self.depth % factor:]
+
+        return view.reshape(-1, factor, len(self.devices)).max(axis=1)
@@ -3,19 +3,27 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
-import pandas as pd
 from time import time
-from random import sample
+from WaterfallBuffer import WaterfallBuffer
+from ColumnSelector import ColumnSelector
+from BlitChart import BlitChart
 
 
 class WaterfallGUI:
-    def __init__(self, root, x, **callbacks):
+    def __init__(self, root, x, depth=100, columns=50, rank='rate', **callbacks):
         self.start = time()
         self.root = root
         self.UPDATE = True
-        self.MACS_SAMPLED = False
-        self.WATERFALL_LENGTH = 100
-        self.Y_AXIS = np.arange(self.WATERFALL_LENGTH)
+        # Rows of history and the most devices shown side by side
+        self.WATERFALL_LENGTH = depth
+        self.COLUMNS = columns
+        # The busiest (or strongest) devices get the columns
+        self.selector = ColumnSelector(columns, rank=rank)
+        self.MACIDS = []
+        self.labels = []
+        self.waterfall = WaterfallBuffer(depth, self.MACIDS)
+        # Narrowest a column label can be squeezed to, in pixels
+        self.LABEL_WIDTH = 14
         self.labs_set = True
 
         self.CMAPS = [
@@ -24,20 +32,21 @@ class WaterfallGUI:
 
         self.CMAP = 'viridis'
 
-        self.sample_macs(x)
         self.create_waterfall_hud(x, **callbacks)
 
     def sample_macs(self, x):
-        N = min(50, len(x.MACID.unique()))
-        # Sample N random MACIDs
-        self.MACIDS = sample([i for i in x.MACID.unique()], N)
+        '''
+        Re-ranks the devices, returns True if the columns changed
+        '''
+        columns = self.selector.select(x.stats, x.clusters)
+        if columns is None:
+            return False
 
-        self.waterfall_container = np.zeros((self.WATERFALL_LENGTH, len(self.MACIDS)))
-        self.waterfall_container.fill(-100)
-        self.waterfall_container = pd.DataFrame(self.waterfall_container)
-        self.waterfall_container.columns = self.MACIDS
-        self.labels = [i[0:5] for i in self.MACIDS]
-        self.MACS_SAMPLED = True
+        self.MACIDS = columns
+        self.waterfall.set_columns(self.MACIDS)
+        self.labels = [x.devices.labels[i] for i in self.MACIDS]
+
+        return True
 
     def create_waterfall_hud(self, x, **callbacks):
         # Put the plot in
@@ -66,20 +75,40 @@ class WaterfallGUI:
 
     def select_CMAP(self, selection):
         self.CMAP = selection
-        self.ax.clear()
-        self.graph = self.ax.pcolormesh(self.MACIDS,
-                                        self.Y_AXIS,
-                                        self.waterfall_container.to_numpy(dtype='float'),
-                                        vmin=-90, vmax=-20, cmap=self.CMAP)
 
-        self.ax.set_xticklabels(self.labels, rotation=90, fontsize=12, color='white')
+        # Only the colour lookup changes, the image itself is kept
+        if self.graph is not None:
+            self.graph.set_cmap(self.CMAP)
+            self.chart.redraw()
+
+    def rows(self):
+        # One row of the image per pixel of the axes is all that can be seen
+        return max(int(self.ax.bbox.height), 1)
+
+    def set_labels(self):
+        N = len(self.MACIDS)
+        shown = max(int(self.ax.bbox.width) // self.LABEL_WIDTH, 1)
+        step = -(-N // shown)
+
+        self.ax.set_xticks(np.arange(0, N, step))
+        self.ax.set_xticklabels(self.labels[::step], rotation=90, fontsize=12, color='white')
 
     def update(self, x):
-        if not self.MACS_SAMPLED:
-            self.sample_macs(x)
+        self.create_waterfall(x, new=False)
+
+    def create_image(self):
+        # A raster image, stretched over fixed extents so a downsampled
+        # frame covers the same area as a full one
+        self.graph = self.ax.imshow(self.waterfall.view(self.rows()),
+                                    aspect='auto', origin='lower',
+                                    interpolation='nearest',
+                                    extent=self.extent(),
+                                    vmin=-90, vmax=-20, cmap=self.CMAP)
+        self.set_labels()
+        self.chart = BlitChart(self.fig, self.canvas, [self.graph])
 
-        else:
-            self.create_waterfall(x, new=False)
+    def extent(self):
+        return (-0.5, len(self.MACIDS) - 0.5, 0, self.WATERFALL_LENGTH)
 
     def create_waterfall(self, x, new=True):
 
@@ -91,46 +120,49 @@ class WaterfallGUI:
             self.fig.subplots_adjust(left=0,right=1,bottom=0.1,top=1)
             self.ax.margins(x=0, y=0., tight=True)
             self.fig.set_facecolor("#3B3B3B")
-            self.last_scan = x.Time.max() - 0.1
-
+            self.graph = None
+            self.last_sample, _, self.generation = x.span()
 
+        # Only the samples since the last frame are read, by sample number
+        first, end, generation = x.span()
+        if generation != self.generation:
+            self.last_sample, self.generation = first, generation
+            # The device IDs start again after a reset
+            self.selector.reset()
+            self.MACIDS = []
+            self.waterfall.set_columns(self.MACIDS)
 
-        # Subset the data
-        data = x[x.Time >= self.last_scan]
+        relabel = self.sample_macs(x)
 
-        # Store the final scan time for the next iteration
-        self.last_scan = x.Time.max()
+        device, rssi, _, _ = x.read(self.last_sample, end)
+        self.last_sample = end
 
-        # Subset the data
-        #if len(self.MACIDS) >= 1:
-        data = data[data.MACID.isin(self.MACIDS)]
+        # Columns are logical devices, so each MAC counts towards its own
+        if x.clusters is not None and len(device):
+            device = x.clusters.roots(int(device.max()) + 1)[device]
 
-        # Collapse the data to MACID and add it in to the plot df
-        grouped_df = data[["MACID", "RSSI"]].groupby(["MACID"])
-        grouped_df = grouped_df.mean().T
-
-        # Add it in
-        self.waterfall_container = pd.concat([self.waterfall_container, grouped_df], ignore_index=True)
-
-        self.waterfall_container.fillna(-100, inplace=True)
-
-        # Drop the first row (which is the oldest reading)
-        self.waterfall_container = self.waterfall_container.iloc[1:, :]
+        # Collapse them to a mean per device and add the row in
+        self.waterfall.push(device, rssi)
 
         if new:
             if len(self.MACIDS) > 0:
-                self.graph = self.ax.pcolormesh(self.MACIDS,
-                                    self.Y_AXIS,
-                                    self.waterfall_container.to_numpy(dtype='float'),
-                                    vmin=-90, vmax=-20, cmap=self.CMAP)
-
-                self.ax.set_xticklabels(self.labels, rotation=90, fontsize=12, color='white')
+                self.create_image()
 
             self.canvas.get_tk_widget().place(relx=0.02, rely=0.02)
             self.canvas.draw()
-        else:
-            self.graph.set_array(self.waterfall_container.to_numpy(dtype='float'))
-            self.fig.canvas.draw_idle()
+        elif len(self.MACIDS) > 0:
+            if self.graph is None:
+                self.create_image()
+                self.canvas.draw()
+            elif relabel:
+                # New columns change the ticks, so the background is redrawn
+                self.graph.set_data(self.waterfall.view(self.rows()))
+                self.graph.set_extent(self.extent())
+                self.set_labels()
+                self.chart.redraw()
+            else:
+                self.graph.set_data(self.waterfall.view(self.rows()))
+                self.chart.update()
 
 
     def destroy(self):
@@ -0,0 +1,158 @@
+import time
+import numpy as np
+
+# Running per-device aggregates over sliding time windows
+
+
+class Window:
+    def __init__(self, seconds):
+        '''
+        Per-device running count, sum and sum of squares of RSSI over the
+        last `seconds` (or everything since the store was cleared if seconds
+        is None). The arrays are indexed by device ID.
+
+        Samples without an RSSI, such as the payload-only updates read from
+        PropertiesChanged, are left out, so the counts and rates are of
+        RSSI readings.
+
+        The arrays are views of buffers that grow by doubling, and add()
+        only touches the devices in the batch, so neither costs more as the
+        number of devices ever seen grows.
+        '''
+        self.seconds = seconds
+        self.tail = 0
+        self.buffers = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))
+        self.counts, self.sums, self.sumsq = self.buffers
+
+    def resize(self, n_devices):
+        n = len(self.counts)
+        if n >= n_devices:
+            return
+
+        if n_devices > len(self.buffers[0]):
+            capacity = max(2 * len(self.buffers[0]), n_devices)
+            grown = (np.zeros(capacity, dtype=np.int64), np.zeros(capacity), np.zeros(capacity))
+            for new, old in zip(grown, (self.counts, self.sums, self.sumsq)):
+                new[:n] = old
+            self.buffers = grown
+
+        self.counts, self.sums, self.sumsq = (buffer[:n_devices] for buffer in self.buffers)
+
+    def reset(self, tail):
+        self.tail = tail
+        self.counts[:] = 0
+        self.sums[:] = 0
+        self.sumsq[:] = 0
+
+    def add(self, device, rssi, sign=1):
+        valid = ~np.isnan(rssi)
+        values = rssi[valid].astype(np.float64)
+        devices, inverse = np.unique(device[valid], return_inverse=True)
+
+        self.counts[devices] += sign * np.bincount(inverse, minlength=len(devices))
+        self.sums[devices] += sign * np.bincount(inverse, weights=values, minlength=len(devices))
+        self.sumsq[devices] += sign * np.bincount(inverse, weights=values**2, minlength=len(devices))
+
+    def total(self):
+        '''
+        Returns (sample count, mean RSSI) across all devices
+        '''
+        n = int(self.counts.sum())
+
+        return n, (self.sums.sum() / n if n else np.nan)
+
+    def means(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.counts
+
+    def stds(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = self.sums / self.counts
+            return np.sqrt(np.maximum(self.sumsq / self.counts - means**2, 0))
+
+    def rates(self):
+        '''
+        Returns signals per second for each device
+        '''
+        return self.counts / self.seconds
+
+
+class WindowStats:
+    def __init__(self, store, windows=(5, 10, 25)):
+        '''
+        Keeps a Window for each of the given lengths plus a global window
+        (key None) over everything since the store was cleared, including
+        samples the retention cap has since dropped.
+
+        update() consumes the samples appended since the last call and
+        expires the ones that have slid out of each window, so its cost
+        depends on how many samples arrived or expired, not on the size of
+        the history. RSSI values are integers, so the running float sums
+        stay exact however long they run.
+        '''
+        self.store = store
+        self.windows = {seconds: Window(seconds) for seconds in windows}
+        self.windows[None] = Window(None)
+        self.head = 0
+        self.generation = None
+        # Time of the last update, which the views treat as now
+        self.now = time.time()
+
+    def __getitem__(self, seconds):
+        return self.windows[seconds]
+
+    def update(self, now=None, snapshot=None):
+        '''
+        Brings the windows up to date with snapshot, or with a new snapshot
+        of the store if none is given
+        '''
+        if now is None:
+            now = time.time()
+        self.now = now
+
+        if snapshot is None:
+            snapshot = self.store.snapshot()
+
+        first, end, generation = snapshot.span()
+        n_devices = snapshot.n_devices
+
+        for window in self.windows.values():
+            window.resize(n_devices)
+
+        # A cleared store starts everything again
+        if generation != self.generation:
+            self.generation = generation
+            self.head = first
+            for window in self.windows.values():
+                window.reset(first)
+
+        # Add everything that arrived since the last update
+        if end > self.head:
+            device, rssi, _, _ = snapshot.read(self.head, end)
+            for window in self.windows.values():
+                window.add(device, rssi)
+            self.head = end
+
+        # Expire what has slid out of each window
+        for window in self.windows.values():
+            if window.seconds is None:
+                continue
+
+            if window.tail < first:
+                # The retention cap dropped samples before they expired
+                self._rebuild(snapshot, window, first, end, now)
+                continue
+
+            device, rssi, ts, _ = snapshot.read(window.tail, end)
+            expired = np.searchsorted(ts, now - window.seconds, side='left')
+
+            if expired:
+                window.add(device[:expired], rssi[:expired], sign=-1)
+                window.tail += expired
+
+    def _rebuild(self, snapshot, window, first, end, now):
+        device, rssi, ts, _ = snapshot.read(first, end)
+        start = np.searchsorted(ts, now - window.seconds, side='left')
+
+        window.reset(first + start)
+        window.add(device[start:], rssi[start:])